@@ -8,6 +8,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import json
 import logging
 import os
 import sys
@@ -26,6 +27,20 @@ SECRET_KEY = os.getenv('API_SECRET', 'debugkey')
 
 MODEL_VECTOR_SIZE = 768
 
+# where VectorIndex snapshots are persisted so we dont have to rebuild every index from postgres on every boot
+INDEX_SNAPSHOT_DIR = Path(os.getenv('INDEX_SNAPSHOT_DIR', BASE_DIR/'snapshots'))
+
+# per deployment overrides of the declared indexes, index name to IndexSpec fields, ie '{"unsplash": {"enabled": false}, "content": {"memory_budget": 2000000000}}'
+INDEX_OVERRIDES: dict[str, dict] = json.loads(os.getenv('INDEX_OVERRIDES', '{}'))
+
+# concurrent embedding requests are gathered for up to EMBED_BATCH_MAX_WAIT seconds, or until EMBED_BATCH_MAX_SIZE strings are waiting, and embedded in one forward pass
+EMBED_BATCH_MAX_SIZE = int(os.getenv('EMBED_BATCH_MAX_SIZE', 64))
+EMBED_BATCH_MAX_WAIT = float(os.getenv('EMBED_BATCH_MAX_WAIT_MS', 5))/1000
+
+# inference backend of the embedding model, 'torch' or 'onnx' for ONNX Runtime, which is faster on CPU, optionally with int8 quantized weights
+EMBED_BACKEND = os.getenv('EMBED_BACKEND', 'torch')
+EMBED_ONNX_QUANTIZE = bool(int(os.getenv('EMBED_ONNX_QUANTIZE', '1')))
+
 if not bool(int(os.getenv('PRODUCTION', '0'))):
     DEBUG = True
     print('DJANGO SETTINGS IN DEBUG')
@@ -75,8 +90,14 @@ MIDDLEWARE = [
 # https://docs.djangoproject.com/en/4.0/topics/cache/#database-caching-1
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'BACKEND': 'v0.cache.TieredCache',  # per process LRU in front of the database cache, so hot entries never leave the process
         'LOCATION': 'django_cache_table',
+        'OPTIONS': {
+            'SHARED_BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCAL_MAX_BYTES': int(os.getenv('CACHE_LOCAL_MAX_BYTES', 64*1024*1024)),
+            'LOCAL_TIMEOUT': 300,  # bounds how long a worker can serve an entry another worker changed or deleted
+            'MAX_ENTRIES': 100000,  # rankings superseded by a newer index cache generation are never read again, they are culled from here along with expired entries
+        },
     }
 }
 
@@ -13,13 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from v0.views import alive
+from v0.views import alive, ready
 from django.contrib import admin
 from django.urls import include, path
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
     path('alive/', alive.as_view(), name='alive'),
+    path('ready/', ready.as_view(), name='ready'),
     path('admin/', admin.site.urls),
     path('v0/', include('v0.urls')),
     # YOUR PATTERNS
@@ -136,13 +136,13 @@ class MediumSpider(scrapy.spiders.CrawlSpider):
 
         # do article AI processing, use Iago api
 
-        # use serverless to get the embedding
-        r = requests.get('https://serverless.iago.jeeny.ai/transform', json={'texts': [article.content]}, verify=False) # didnt fix the ssl issue on serverless yet
+        # embed the whole article as a document, chunked rather than cut off at the first 384 tokens
+        r = requests.post('https://api.iago.jeeny.ai/v0/transform', json={'texts': [article.content], 'document': True}, auth=(self.IAGO_API_USER, self.IAGO_API_PASS))
         if r.status_code == 200:
-            logger.info(f'IAGO serverless embed complete for {article.title}')
+            logger.info(f'IAGO embed complete for {article.title}')
             article.embedding_all_mpnet_base_v2 = r.json()['vectors'][0]
         else:
-            logger.error(f'Iago Serverless API {r.status_code} {r.text}')
+            logger.error(f'Iago transform API {r.status_code} {r.text}')
             return
 
         # then use django iago to get the skills
@@ -0,0 +1,36 @@
+""" cost of building the cache key of a query, the old get_hash of the json serialized vector and SQL vs hashing the raw float32 bytes """
+import header
+
+import timeit
+
+import numpy as np
+
+from v0 import index
+from v0.utils import generate_cache_key, vector_cache_key
+
+N = 10000
+
+vector_index = index.get_index('content')
+rng = np.random.default_rng(0)
+vectors = rng.standard_normal((N, vector_index.d), dtype=np.float32)
+vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+filter_items = sorted({'type__in': ['article', 'video'], 'content_read_seconds__range': [0, 600]}.items())
+
+
+def old_keys():
+    """ the previous VectorIndex._rank key, kept here as the baseline """
+    return [generate_cache_key(x.tolist(), str(vector_index.queryset.query), 10, 0.0, None, dict(filter_items), version=5) for x in vectors]
+
+
+def new_keys():
+    return [vector_cache_key(vector_index._cache_namespace, x, 10, 0.0, None, filter_items) for x in vectors]
+
+
+assert len(set(new_keys())) == N, 'vector keys collided'
+old = min(timeit.repeat(old_keys, number=1, repeat=3))/N
+new = min(timeit.repeat(new_keys, number=1, repeat=3))/N
+print(f'{N} keys of {vector_index.d} dimensional vectors')
+print(f'{"key":<12}{"us/key":>10}')
+print(f'{"get_hash":<12}{old*1e6:>10.2f}')
+print(f'{"blake2b":<12}{new*1e6:>10.2f}')
+print(f'{"":<12}{old/new:>9.1f}x')
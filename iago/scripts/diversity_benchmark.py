@@ -0,0 +1,53 @@
+""" microbenchmark of the numpy diversity filter against the old torch cos_sim + nested python loop implementation """
+import sys
+from pathlib import Path
+
+sys.dont_write_bytecode = True
+sys.path.append(str(Path(__file__).parent.parent.absolute()))  # no django needed, so we skip header
+
+import time
+
+import numpy as np
+from sentence_transformers import util
+
+from v0 import diversity
+
+MIN_DISTANCE = .21
+REPEATS = 5
+
+
+def old_min_distance(vectors: np.ndarray, min_distance: float):
+    """ the previous VectorIndex._min_distance, kept here as the baseline """
+    cosine_scores = np.array(util.cos_sim(vectors, vectors))
+    results_to_remove = set()
+    for i, vector_results in enumerate(cosine_scores):
+        for j, result in enumerate(vector_results):
+            if i not in results_to_remove and j not in results_to_remove and i != j and 1-result < min_distance:
+                results_to_remove.add(j)
+    return [i for i in range(len(vectors)) if i not in results_to_remove]
+
+
+def timed(fn, *args):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter()-start)
+    return best, result
+
+
+rng = np.random.default_rng(0)
+print(f'{"k":>6}{"old (ms)":>12}{"numpy (ms)":>12}{"speedup":>10}{"mmr (ms)":>12}')
+for k in (100, 250, 500, 1000):
+    # clustered vectors so that min_distance actually removes things, like real search results do
+    centers = rng.standard_normal((k//10, 768)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), k)] + .5*rng.standard_normal((k, 768)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = np.sort(rng.random(k).astype(np.float32))[::-1]
+
+    old_time, old_kept = timed(old_min_distance, vectors, MIN_DISTANCE)
+    new_time, new_kept = timed(diversity.min_distance_filter, vectors, MIN_DISTANCE)
+    mmr_time, _ = timed(diversity.mmr, vectors, scores, .5)
+    assert list(new_kept) == old_kept, 'numpy filter does not match the old implementation'
+
+    print(f'{k:>6}{old_time*1000:>12.2f}{new_time*1000:>12.2f}{old_time/new_time:>9.1f}x{mmr_time*1000:>12.2f}')
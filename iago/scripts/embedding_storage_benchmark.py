@@ -0,0 +1,42 @@
+""" table size and load time of embeddings stored as double precision[], the old ArrayField, vs float32 bytea, the EmbeddingField """
+import header
+
+import time
+
+import numpy as np
+from django.db import connection
+from psycopg2.extras import execute_values
+
+from v0.models import Content
+
+N = 20000
+
+vectors = np.stack(list(Content.objects.exclude(embedding_all_mpnet_base_v2__isnull=True).values_list('embedding_all_mpnet_base_v2', flat=True)[:N]))
+print(f'{len(vectors)} content embeddings')
+
+with connection.cursor() as cursor:
+    cursor.execute('CREATE TEMP TABLE bench_array (id integer PRIMARY KEY, embedding double precision[])')
+    cursor.execute('CREATE TEMP TABLE bench_bytea (id integer PRIMARY KEY, embedding bytea)')
+    execute_values(cursor.cursor, 'INSERT INTO bench_array VALUES %s', [(i, x.tolist()) for i, x in enumerate(vectors)])
+    execute_values(cursor.cursor, 'INSERT INTO bench_bytea VALUES %s', [(i, x.astype('<f4').tobytes()) for i, x in enumerate(vectors)])
+    cursor.execute('VACUUM ANALYZE bench_array')
+    cursor.execute('VACUUM ANALYZE bench_bytea')
+
+    def load(table: str, decode) -> tuple[float, np.ndarray]:
+        """ seconds to read every row into a float32 matrix, what a VectorIndex build and hydrating the rows both pay """
+        start = time.perf_counter()
+        cursor.execute(f'SELECT embedding FROM {table} ORDER BY id')
+        loaded = np.empty(vectors.shape, dtype=np.float32)
+        for i, (embedding,) in enumerate(cursor.fetchall()):
+            loaded[i] = decode(embedding)
+        return time.perf_counter()-start, loaded
+
+    print(f'{"storage":<20}{"table MB":>10}{"load (s)":>10}')
+    sizes, times = {}, {}
+    for table, decode in [('bench_array', lambda x: x), ('bench_bytea', lambda x: np.frombuffer(x, dtype='<f4'))]:
+        cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+        sizes[table] = cursor.fetchone()[0]
+        times[table], loaded = min((load(table, decode) for _ in range(3)), key=lambda x: x[0])
+        assert np.allclose(loaded, vectors, atol=1e-6), f'{table} did not round trip'
+        print(f'{table:<20}{sizes[table]/1e6:>10.1f}{times[table]:>10.3f}')
+    print(f'{"bytea/array":<20}{sizes["bench_bytea"]/sizes["bench_array"]:>10.2f}{times["bench_bytea"]/times["bench_array"]:>10.2f}')
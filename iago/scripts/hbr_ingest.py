@@ -33,7 +33,12 @@ print(df.shape)
 
 # embed content
 print('Embedding content...')
-embeds = ai.embedding_model.model.encode(df['content'].values, show_progress_bar=True)
+embeds = ai.embedding_model.encode_documents(df['content'].tolist(), show_progress_bar=True)
+
+# find a thumbnail for every article in one search
+print('Matching thumbnails...')
+index.get_index('unsplash').wait_ready()
+imgs, rankings, query_vectors = index.get_index('unsplash').query_batch(embeds, k=1, use_cached=False)
 
 # truncate texts for summarization
 # print('Truncating text to max_tokens...')
@@ -73,17 +78,18 @@ for i, row in tqdm(df.iterrows(), total=df.shape[0]):
         # content.summary = summaries[i]
 
         # thumbnail
-        img = index.unsplash_photo_index.query(content.embedding_all_mpnet_base_v2, k=1, use_cached=False)[0][0]
-        content.thumbnail_alternative = img
+        if len(imgs[i]) > 0:
+            content.thumbnail_alternative = imgs[i][0]
 
     contents.append(content)
 
 Content.objects.bulk_create(contents)
 
-# okay now we have it saved we do relationships
-for content in tqdm(contents):
-    if content.embedding_all_mpnet_base_v2 is not None:
-        skills, rankings, query_vector = index.skills_index.query(content.embedding_all_mpnet_base_v2, k=5, min_distance=.21)
-        content.skills.set(skills)
+# okay now we have it saved we do relationships, matching the skills of every article in one search
+embedded_contents = [x for x in contents if x.embedding_all_mpnet_base_v2 is not None]
+index.get_index('skill').wait_ready()
+skills_batch, rankings, query_vectors = index.get_index('skill').query_batch([x.embedding_all_mpnet_base_v2 for x in embedded_contents], k=5, min_distance=.21)
+for content, skills in tqdm(zip(embedded_contents, skills_batch), total=len(embedded_contents)):
+    content.skills.set(skills)
 
 print(f'Took {time.perf_counter()-start:.3f}s')
@@ -0,0 +1,45 @@
+""" peak memory and time of loading the vectors of an index from postgres, the old list-then-convert way vs streaming into a preallocated array """
+import header
+
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from v0 import index
+
+queryset = index.get_index('content').queryset
+
+
+def old_load():
+    """ the previous VectorIndex._generate_index load, kept here as the baseline """
+    pks, vectors = zip(*list(queryset.values_list('pk', 'embedding_all_mpnet_base_v2')))
+    return list(pks), np.array(vectors).astype(np.float32)
+
+
+def new_load():
+    pks, vectors, columns = index.get_index('content')._load_rows()
+    return pks, vectors
+
+
+def measure(fn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    pks, vectors = fn()
+    elapsed = time.perf_counter()-start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, vectors
+
+
+old_time, old_peak, old_vectors = measure(old_load)
+new_time, new_peak, new_vectors = measure(new_load)
+assert np.array_equal(old_vectors, new_vectors), 'streamed vectors do not match the old load'
+
+print(f'{len(new_vectors)} vectors of {queryset.model.__name__}, final array is {new_vectors.nbytes/1e6:.1f} MB')
+print(f'{"loader":<12}{"peak MB":>12}{"time (s)":>12}')
+print(f'{"old":<12}{old_peak/1e6:>12.1f}{old_time:>12.3f}')
+print(f'{"streaming":<12}{new_peak/1e6:>12.1f}{new_time:>12.3f}')
+print(f'{"":<12}{old_peak/new_peak:>11.1f}x{old_time/new_time:>11.1f}x')
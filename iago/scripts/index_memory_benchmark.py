@@ -0,0 +1,44 @@
+""" memory held per index, the old flat layout (vectors matrix + IndexIDMap(IndexFlatIP) copy + pk list and dict) vs the current generations """
+import header
+
+import gc
+import tracemalloc
+
+import faiss
+import numpy as np
+
+from v0 import index
+
+indexes = list(index.indexes.values())
+
+
+def old_footprint(vector_index: index.VectorIndex) -> int:
+    """ bytes the previous VectorIndex held for the same rows, kept here as the baseline """
+    generation = vector_index.generation
+    gc.collect()
+    tracemalloc.start()
+    pks = list(generation.pks)  # python pk objects
+    pk_to_id = {pk: i for i, pk in enumerate(pks)}
+    pks_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    vectors = np.ascontiguousarray(generation.vectors, dtype=np.float32)
+    flat = faiss.IndexIDMap(faiss.IndexFlatIP(vectors.shape[1]))
+    flat.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    faiss_bytes = faiss.serialize_index(flat).nbytes
+    del pk_to_id, pks, flat
+    return vectors.nbytes + faiss_bytes + pks_bytes
+
+
+print(f'{"index":<32}{"vectors":>10}{"old MB":>10}{"new MB":>10}{"saved":>8}')
+total_old = total_new = 0
+for vector_index in indexes:
+    vector_index.wait_ready()
+    generation = vector_index.generation
+    old = old_footprint(vector_index)
+    # memory_usage does not count memory-mapped pages, count the mapped vectors and pks as if they were all paged in to compare like for like
+    usage = generation.memory_usage()
+    mapped = sum(x.nbytes for x in (generation._vectors, generation.pks._base) if isinstance(x, np.memmap))
+    new = usage['index'] + usage['vectors'] + usage['pks'] + mapped
+    total_old, total_new = total_old+old, total_new+new
+    print(f'{vector_index.name:<32}{generation.ntotal:>10}{old/1e6:>10.1f}{new/1e6:>10.1f}{1-new/old:>7.0%}')
+print(f'{"total":<32}{"":>10}{total_old/1e6:>10.1f}{total_new/1e6:>10.1f}{1-total_new/total_old:>7.0%}')
@@ -0,0 +1,54 @@
+""" memory saved and recall@k of compressed VectorIndex storage against the flat baseline """
+import header
+
+import time
+
+import numpy as np
+
+from v0 import index
+
+K = 10
+N_QUERIES = 1000
+CONFIGS = [  # factory, rerank
+    ('Flat', 0),
+    ('SQfp16', 0),
+    ('SQ8', 0),
+    ('SQ8', 4),
+    ('PQ96', 0),
+    ('PQ96', 4),
+]
+
+source = index.get_index('content')
+source.wait_ready()
+pks, vectors = list(source.pks), np.ascontiguousarray(source.generation.vectors)
+rng = np.random.default_rng(0)
+queries = vectors[rng.choice(len(vectors), min(N_QUERIES, len(vectors)), replace=False)]
+print(f'{len(vectors)} vectors from {source.name}, {len(queries)} queries, k={K}')
+
+baseline = None
+baseline_bytes = None
+print(f'{"storage":<12}{"rerank":>8}{"index MB":>12}{"vectors MB":>12}{"saved":>8}{f"recall@{K}":>12}{"ms/query":>10}')
+for factory, rerank in CONFIGS:
+    vector_index = index.VectorIndex(source.queryset, False, name=f'bench_{factory}', factory=factory, rerank=rerank)
+    generation = vector_index._build_generation(list(pks), vectors)
+    if generation.compressed:  # like a real build, the exact vectors live on disk for compressed storage
+        vector_index._save_snapshot(generation, 'benchmark')
+        generation._vectors = np.load(vector_index._snapshot_paths()['vectors'], mmap_mode='r')
+
+    start = time.perf_counter()
+    results = generation.search(queries, K, rerank=rerank)
+    elapsed = (time.perf_counter()-start)/len(queries)
+
+    found = [set(row_indices.tolist()) for row_values, row_indices in results]
+    if baseline is None:
+        baseline = found
+    recall = np.mean([len(x & y)/K for x, y in zip(found, baseline)])
+
+    usage = generation.memory_usage()
+    total = usage['index'] + usage['vectors']
+    if baseline_bytes is None:
+        baseline_bytes = total
+    print(f'{factory:<12}{rerank:>8}{usage["index"]/1e6:>12.1f}{usage["vectors"]/1e6:>12.1f}{1-total/baseline_bytes:>7.0%}{recall:>12.3f}{elapsed*1000:>10.3f}')
+
+    for path in vector_index._snapshot_paths().values():
+        path.unlink(missing_ok=True)
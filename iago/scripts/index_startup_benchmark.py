@@ -0,0 +1,37 @@
+""" benchmark cold (rebuild from postgres) vs warm (load from snapshot) startup of the VectorIndexes """
+import header
+
+import tempfile
+import time
+from pathlib import Path
+
+from v0 import index
+
+# the app warms its indexes in the background at startup, let that finish so it does not race us for the snapshot files
+if index.warmup_thread is not None:
+    index.warmup_thread.join()
+
+# snapshot somewhere of our own, so the production snapshots are neither thrown away nor overwritten
+index.INDEX_SNAPSHOT_DIR = Path(tempfile.mkdtemp(prefix='index_startup_benchmark_'))
+indexes = [index.specs[name].build() for name in index.indexes]
+
+# cold boot, our snapshot dir starts empty so every index has to be pulled from postgres
+cold = {}
+for vector_index in indexes:
+    start = time.perf_counter()
+    vector_index._load_or_generate_index()
+    cold[vector_index.name] = time.perf_counter()-start
+
+# warm boot, fresh objects so nothing is reused from the cold run
+warm = {}
+for vector_index in indexes:
+    fresh = index.specs[vector_index.name].build()  # same factory, attributes and search params, or the snapshot would not match and we would time a rebuild
+    start = time.perf_counter()
+    fresh._load_or_generate_index()
+    warm[vector_index.name] = time.perf_counter()-start
+
+print(f'{"index":<20}{"vectors":>10}{"cold (s)":>12}{"warm (s)":>12}{"speedup":>10}')
+for vector_index in indexes:
+    name = vector_index.name
+    print(f'{name:<20}{vector_index.generation.ntotal:>10}{cold[name]:>12.3f}{warm[name]:>12.3f}{cold[name]/warm[name]:>9.1f}x')
+print(f'{"total":<20}{"":>10}{sum(cold.values()):>12.3f}{sum(warm.values()):>12.3f}{sum(cold.values())/sum(warm.values()):>9.1f}x')
@@ -0,0 +1,44 @@
+""" parity with torch and throughput across batch sizes of the onnx backends of the embedding model """
+import header
+
+import time
+
+import numpy as np
+
+from v0 import ai
+from v0.onnx_backend import PARITY_SENTENCES, OnnxEncoder
+
+BATCH_SIZES = [1, 4, 16, 64]
+SECONDS = 5  # per backend and batch size
+
+model = ai.embedding_model.model
+path = ai.HERE/'models'/f'{ai.embedding_model.name.replace("/", "_")}.onnx'  # where TransformerModel keeps its export
+texts = [x for x in PARITY_SENTENCES for _ in range(max(BATCH_SIZES)//len(PARITY_SENTENCES)+1)]
+
+backends = {
+    'torch': lambda x: model.encode(x, batch_size=len(x)),
+    'onnx': OnnxEncoder(model, path).encode,
+    'onnx int8': OnnxEncoder(model, path, quantize=True).encode,
+}
+
+
+def throughput(encode, batch_size: int) -> float:
+    """ strings embedded per second """
+    batch = texts[:batch_size]
+    encode(batch)  # warm up
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter()-start < SECONDS:
+        encode(batch)
+        n += batch_size
+    return n/(time.perf_counter()-start)
+
+
+expected = model.encode(PARITY_SENTENCES)
+print(f'{"backend":<12}{"min cos":>10}{"mean cos":>10}{"size MB":>10}' + ''.join(f'{f"bs={x}/s":>10}' for x in BATCH_SIZES))
+for name, encode in backends.items():
+    actual = encode(PARITY_SENTENCES)
+    cos = np.sum(expected*actual, axis=1)/(np.linalg.norm(expected, axis=1)*np.linalg.norm(actual, axis=1))
+    graph = {'onnx': path, 'onnx int8': path.with_suffix('.int8.onnx')}.get(name)
+    size = f'{graph.stat().st_size/1e6:>10.1f}' if graph else f'{"":>10}'
+    print(f'{name:<12}{cos.min():>10.4f}{cos.mean():>10.4f}{size}' + ''.join(f'{throughput(encode, x):>10.1f}' for x in BATCH_SIZES))
@@ -6,11 +6,15 @@ from pathlib import Path
 
 import numpy as np
 import torch
-from iago.settings import DEBUG
+from iago.settings import DEBUG, EMBED_BACKEND, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT, EMBED_ONNX_QUANTIZE
 from sentence_transformers import SentenceTransformer
+from tqdm import tqdm
 from transformers import AutoTokenizer, pipeline
 
+from v0.batching import MicroBatcher
 from v0.models import GenericStringEmbedding
+from v0.onnx_backend import OnnxEncoder
+from v0.singleflight import SingleFlight
 
 HERE = Path(__file__).parent
 logger = logging.getLogger(__name__)
@@ -21,61 +25,152 @@ os.makedirs(HERE/'models', exist_ok=True)
 class TransformerModel():
     """ simple handler for sentence_transformers models """
 
-    def __init__(self, name: str, max_seq_length: int):
+    def __init__(self, name: str, max_seq_length: int, backend: str = 'torch', quantize: bool = False, min_parity: float = 0.99):
+        """
+        Args:
+            name (str): sentence_transformers model name
+            max_seq_length (int): Tokens past this are truncated
+            backend (str, optional): 'torch', or 'onnx' to run an ONNX Runtime export of the model. Defaults to 'torch'.
+            quantize (bool, optional): Whether the onnx backend quantizes the weights to int8. Defaults to False.
+            min_parity (float, optional): Lowest cosine similarity to the torch embeddings the onnx backend may have on the parity sentences, below it we stay on torch. Defaults to 0.99.
+        """
         self.name = name
         self.max_seq_length = max_seq_length
+        self.backend = backend
+        self.quantize = quantize
+        self.min_parity = min_parity
         self.model: SentenceTransformer
+        self.onnx: OnnxEncoder | None = None
+        self._in_flight = SingleFlight()  # a burst of the same strings is embedded once
+        self.batcher = MicroBatcher(self._forward, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT, name=f'embed_batcher_{name}')  # and concurrent bursts of different strings in one forward pass
         self.load()
 
     def load(self):
         """ loads model """
         self.model = SentenceTransformer(self.name, cache_folder=HERE/'models')
         self.model.max_seq_length = self.max_seq_length
+        if self.backend == 'onnx':
+            self.onnx = self._load_onnx()
+
+    def _load_onnx(self) -> OnnxEncoder | None:
+        """ the onnx encoder if it exports, loads and agrees with torch, else None so we keep serving from torch """
+        try:
+            onnx = OnnxEncoder(self.model, HERE/'models'/f'{self.name.replace("/", "_")}.onnx', quantize=self.quantize)
+            parity = onnx.parity()
+        except Exception:
+            logger.exception(f'Could not load the onnx backend of {self.name}, using torch')
+            return None
+        if parity.min() < self.min_parity:
+            logger.error(f'The onnx backend of {self.name} has a parity of {parity.min():.4f} with torch, below {self.min_parity}, using torch')
+            return None
+        logger.info(f'Using the onnx backend of {self.name}, {"int8" if self.quantize else "fp32"}, parity with torch {parity.min():.4f}')
+        return onnx
+
+    def _length_buckets(self, strings: list[str], batch_size: int) -> list[np.ndarray]:
+        """ indices of strings sorted by token length and cut into batches of at most batch_size, a batch is also cut where lengths drop under half its longest, so little compute goes to padding """
+        lengths = np.array([len(x) for x in self.model.tokenizer(strings, truncation=True, max_length=self.max_seq_length)['input_ids']])
+        order = np.argsort(-lengths, kind='stable')
+        buckets = []
+        start = 0
+        for i in range(1, len(order)+1):
+            if i == len(order) or i-start >= batch_size or lengths[order[i]]*2 < lengths[order[start]]:
+                buckets.append(order[start:i])
+                start = i
+        return buckets
+
+    def _model_encode(self, strings: list[str], batch_size: int = 32, show_progress_bar=False) -> np.ndarray:
+        """ embeds with whichever backend is loaded, in length buckets """
+        embeds = np.empty((len(strings), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        for bucket in tqdm(self._length_buckets(strings, batch_size) if strings else [], desc='Batches', disable=not show_progress_bar):
+            bucket_strings = [strings[i] for i in bucket]
+            if self.onnx is not None:
+                embeds[bucket] = self.onnx.encode(bucket_strings, batch_size=len(bucket))
+            else:
+                embeds[bucket] = self.model.encode(bucket_strings, batch_size=len(bucket))
+        return embeds
+
+    def _forward(self, strings: list[str]) -> np.ndarray:
+        """ everything the batcher gathered, in as few forward passes as the length buckets allow """
+        return self._model_encode(strings, batch_size=max(len(strings), 1))
+
+    def _chunk_spans(self, text: str, overlap: int) -> list[tuple[int, int]]:
+        """ character spans of the windows of max_seq_length tokens a text is embedded in, consecutive windows share overlap tokens """
+        window = self.max_seq_length-2  # room for the special tokens
+        offsets = self.model.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+        if len(offsets) <= window:
+            return [(0, len(text))]
+        return [(offsets[i][0], offsets[min(i+window, len(offsets))-1][1]) for i in range(0, len(offsets)-overlap, window-overlap)]
+
+    def encode_documents(self, texts: list[str], pooling: str = 'mean', overlap: int = 64, return_chunks=False, show_progress_bar=False):
+        """ Embed whole documents, where encode only sees the first max_seq_length tokens of each text
+
+        Texts are split into overlapping windows of max_seq_length tokens, every window of every text is embedded in one batch and the windows of each text are pooled into its vector.
+        Documents are not cached, they rarely repeat and would bloat GenericStringEmbedding.
+
+        Args:
+            texts (list[str]): The documents
+            pooling (str, optional): 'mean' or 'max' over the window vectors. Defaults to 'mean'.
+            overlap (int, optional): Tokens consecutive windows share, so no sentence is only ever seen cut in half. Defaults to 64.
+            return_chunks (bool, optional): Whether to also return the window vectors and character spans of each text. Defaults to False.
+
+        Returns:
+            np.ndarray: One unit vector per text
+            list[tuple[np.ndarray, list[tuple[int, int]]]]: With return_chunks, the window vectors and their character spans of each text
+        """
+        if pooling not in ('mean', 'max'):
+            raise ValueError(f'Unknown pooling {pooling}, use mean or max')
+        spans = [self._chunk_spans(text, overlap) for text in texts]
+        chunk_embeds = self._model_encode([text[start:end] for text, text_spans in zip(texts, spans) for start, end in text_spans], show_progress_bar=show_progress_bar)
+
+        pool = np.mean if pooling == 'mean' else np.max
+        bounds = np.cumsum([0]+[len(x) for x in spans])
+        embeds = np.stack([pool(chunk_embeds[x:y], axis=0) for x, y in zip(bounds, bounds[1:])]) if texts else chunk_embeds
+        embeds /= np.maximum(np.linalg.norm(embeds, axis=1, keepdims=True), 1e-12)  # pooled vectors are no longer unit length like the window vectors
+        if return_chunks:
+            return embeds, [(chunk_embeds[x:y], text_spans) for x, y, text_spans in zip(bounds, bounds[1:], spans)]
+        return embeds
 
     def encode(self, strings: list[str], use_cache=True, show_progress_bar=False):
-        """ gets embeds from strings from cache if availablbe, else embeds strings and saves to cache and returns """
-        start = time.perf_counter()
+        """ gets embeds from strings from cache if availablbe, else embeds strings and saves to cache and returns, identical concurrent calls share one embedding """
+        return self._in_flight.do((tuple(strings), use_cache), self._encode, strings, use_cache, show_progress_bar).copy()  # the array is shared with every waiter
 
-        # validate that we can use cache - GenericStringEmbedding uses charfield so thats max 255 chars
-        if use_cache and any(len(x) > 255 for x in strings):
-            use_cache = False
-            logger.warning('Cannot use cache for strings with more than 255 chars')
+    def _encode(self, strings: list[str], use_cache=True, show_progress_bar=False):
+        start = time.perf_counter()
 
-        # first get what we can from cache and build a list of ones we still need to embed
-        cache = []
+        # with the cache, strings are embedded in their normalized form and keyed by its hash, otherwise exactly as given, either way each distinct text is embedded once
         if use_cache:
-            strings = [s.lower() for s in strings]
-            cache = list(GenericStringEmbedding.objects.filter(name__in=strings))
-            cached_strings = [x.name for x in cache]  # so we know what we have
-            uncached_strings = [x for x in strings if x not in cached_strings]
-            logger.info(f'Embedder got {len(cached_strings)}/{len(strings)} from cache in {time.perf_counter()-start:.3f}s')
+            texts = [GenericStringEmbedding.normalize(x) for x in strings]
         else:
-            uncached_strings = strings
+            texts = list(strings)
+        unique_texts = list(dict.fromkeys(texts))
+
+        # first get what we can from cache
+        embeds: dict[str, list[float]] = {}
+        if use_cache:
+            hashes = {x: GenericStringEmbedding.text_hash(self.name, x) for x in unique_texts}
+            by_hash = dict(GenericStringEmbedding.objects.filter(hash__in=hashes.values()).values_list('hash', 'embedding_all_mpnet_base_v2'))
+            embeds = {x: by_hash[h] for x, h in hashes.items() if h in by_hash}
+            logger.info(f'Embedder got {len(embeds)}/{len(unique_texts)} from cache in {time.perf_counter()-start:.3f}s')
 
         # next embed the ones we still need and save to cache
-        new_cache = []
-        if not use_cache or len(uncached_strings) > 0:
-            new_embeds = self.model.encode(uncached_strings, show_progress_bar=show_progress_bar)
-            for i, string in enumerate(uncached_strings):
-                new_cache.append(GenericStringEmbedding().create(string, new_embeds[i]))
-
-            if use_cache:
-                GenericStringEmbedding.objects.bulk_create(new_cache)
+        uncached_texts = [x for x in unique_texts if x not in embeds]
+        if uncached_texts:
+            if show_progress_bar or len(uncached_texts) >= self.batcher.max_batch_size:  # bulk jobs are a batch of their own
+                new_embeds = self._model_encode(uncached_texts, show_progress_bar=show_progress_bar)
+            else:
+                new_embeds = self.batcher.submit(uncached_texts)
+            embeds.update(zip(uncached_texts, new_embeds))
+
+            if use_cache:  # another worker may have cached the same text meanwhile, the unique hash makes that a no-op
+                GenericStringEmbedding.objects.bulk_create([GenericStringEmbedding().create(x, y, self.name) for x, y in zip(uncached_texts, new_embeds)], ignore_conflicts=True)
             logger.info(f'Finished embedding and saved to cache in {time.perf_counter()-start:.3f}s')
 
-        # finally, join the cached and new, order by original param, and return
-        joined = cache + new_cache
-        joined_strings = [x.name for x in joined]
-        results = []
-        for string in strings:
-            i = joined_strings.index(string.lower())
-            results.append(joined[i].embedding_all_mpnet_base_v2)
-
-        return np.asarray(results)
+        # finally, order by original param and return
+        return np.asarray([embeds[x] for x in texts])
 
 
 # define embedding model
-embedding_model = TransformerModel('all-mpnet-base-v2', max_seq_length=384)
+embedding_model = TransformerModel('all-mpnet-base-v2', max_seq_length=384, backend=EMBED_BACKEND, quantize=EMBED_ONNX_QUANTIZE)
 
 # summarizer model
 
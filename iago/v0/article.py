@@ -125,8 +125,8 @@ def medium_to_markdown(text_block: dict, i: int, paragraphs_raw: list[dict]) ->
 # update article method - basically the ingestion method
 
 
-def updateArticle(article_uuid):
-    """ seperate function for job pooling """
+def updateArticle(article_uuid) -> bool:
+    """ seperate function for job pooling, returns whether the content indexes changed, the caller invalidates their cached rankings once per batch """
     start = time.perf_counter()
     article: Content = Content.objects.get(uuid=article_uuid)
 
@@ -141,7 +141,7 @@ def updateArticle(article_uuid):
                 logger.info(f'Article {article.title} is 410 gone, deleting')
                 article.deleted = True
                 article.save()
-                return
+                return index.sync_content(article, invalidate=False)
             elif r.status_code == 429:  # we need to wait
                 retry_time = int(r.headers['Retry-After'])
                 logger.info(f'Article {article.title} is 429 throttled, retrying in {retry_time} seconds')
@@ -150,7 +150,7 @@ def updateArticle(article_uuid):
                 r = requests.get(f'https://medium.com/_/api/posts/{postID}', headers=headers)
                 logger.debug(f'retried after 429, new headers are {r.headers}')
             else:
-                return
+                return False
 
         data = json.loads(r.text[16:])
 
@@ -160,7 +160,8 @@ def updateArticle(article_uuid):
             if 'deleted' in data['error']:  # though its possible we just got rate limited, so make sure to check the error
                 article.deleted = True
                 article.save()
-            return
+                return index.sync_content(article, invalidate=False)
+            return False
         else:
             article.deleted = False
 
@@ -214,8 +215,9 @@ def updateArticle(article_uuid):
             article.thumbnail = None
 
         # get us an alternate thumbnail from our unsplash images library
-        if hasattr(index, 'unsplash_photo_index') and (article.thumbnail_alternative is None or article.thumbnail_alternative_url is None):
-            img = index.unsplash_photo_index.query(article.embedding_all_mpnet_base_v2, k=1, use_cached=False)[0][0]
+        if 'unsplash' in index.indexes and (article.thumbnail_alternative is None or article.thumbnail_alternative_url is None):
+            index.indexes['unsplash'].wait_ready()  # not a request, so wait for it to warm rather than get IndexWarming
+            img = index.indexes['unsplash'].query(article.embedding_all_mpnet_base_v2, k=1, use_cached=False)[0][0]
             article.thumbnail_alternative = img
 
         # summarize if we dont have a summary yet
@@ -225,7 +227,9 @@ def updateArticle(article_uuid):
             article.summary[ai.SUMMARIZER_CONFIG['MODEL_NAME']] = ai.summarizer(clean_text, min_length=ai.SUMMARIZER_CONFIG['MIN_LENGTH'], no_repeat_ngram_size=ai.SUMMARIZER_CONFIG['NO_REPEAT_NGRAM_SIZE'])[0]['summary_text']
 
         article.save()
+        changed = index.sync_content(article, invalidate=False)  # keep the filterable attributes in the content indexes current
         logger.info(f'Updated {article.title} in {time.perf_counter()-start:.3f}s')
+        return changed
     except Exception as e:
         err = str(e)
         logger.error(err)  # we do get banned if we have hit too fast - about 10 requests per second i think but not sure
@@ -233,3 +237,5 @@ def updateArticle(article_uuid):
             article.deleted = True
             logger.error(f'Logging {article.title} as deleted')
             article.save()
+            return index.sync_content(article, invalidate=False)
+        return False
@@ -0,0 +1,137 @@
+""" dynamic micro-batching, concurrent small calls of a batch function are gathered into one call """
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram():
+    """ Counts of observed values per bucket, cumulative like prometheus histograms so any two buckets can be subtracted """
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(sorted(bounds))
+        self._counts = [0]*(len(self.bounds)+1)  # the last one counts values over every bound
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._sum += value
+
+    def as_dict(self) -> dict:
+        """ Number of observations less than or equal to each bound, with their count and sum """
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = np.cumsum(counts).tolist()
+        return {'buckets': {**{str(x): y for x, y in zip(self.bounds, cumulative)}, '+Inf': cumulative[-1]}, 'count': cumulative[-1], 'sum': total}
+
+
+class _Request():
+    """ Items waiting to be batched and, once done is set, their results or the exception the batch raised """
+
+    def __init__(self, items: Sequence):
+        self.items = items
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class MicroBatcher():
+    """ Gather the items of concurrent submits for up to max_wait seconds, or until max_batch_size items are waiting, and run fn once on all of them
+
+    fn takes a list of items and returns an array with one row per item, each submit gets back the rows of its own items.
+    A single worker thread runs the batches, it is started on the first submit so forked workers each get their own.
+    """
+
+    def __init__(self, fn: Callable[[list], np.ndarray], max_batch_size: int = 64, max_wait: float = 0.005, name: str = 'micro_batcher'):
+        """
+        Args:
+            fn (Callable[[list], np.ndarray]): The batch function
+            max_batch_size (int, optional): Most items in a batch, a single submit larger than this is run on its own. Defaults to 64.
+            max_wait (float, optional): Longest the first request of a batch waits for others to join it, in seconds. Defaults to 5ms.
+            name (str, optional): Name of the worker thread. Defaults to 'micro_batcher'.
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue: deque[_Request] = deque()
+        self._queued_items = 0
+        self._not_empty = threading.Condition()
+        self._worker: threading.Thread | None = None
+        # batch sizes in items, and seconds each request waited in the queue before its batch started
+        self.batch_sizes = Histogram((1, 2, 4, 8, 16, 32, 64, 128, 256))
+        self.queue_waits = Histogram((0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1))
+
+    def submit(self, items: Sequence) -> np.ndarray:
+        """ Run fn on the items as part of the next batch, blocks until it is done
+
+        Returns:
+            np.ndarray: The rows fn returned for these items, in order
+        """
+        request = _Request(items)
+        with self._not_empty:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+            self._queue.append(request)
+            self._queued_items += len(items)
+            self._not_empty.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _take_batch(self) -> list[_Request]:
+        """ Wait for a request, then for others to join it until the batch is full or max_wait has passed since the first was enqueued """
+        with self._not_empty:
+            while not self._queue:
+                self._not_empty.wait()
+            deadline = self._queue[0].enqueued+self.max_wait
+            while self._queued_items < self.max_batch_size and (remaining := deadline-time.perf_counter()) > 0:
+                self._not_empty.wait(remaining)
+            batch = [self._queue.popleft()]  # the first one always goes, even if it is bigger than a batch on its own
+            size = len(batch[0].items)
+            while self._queue and size+len(self._queue[0].items) <= self.max_batch_size:
+                request = self._queue.popleft()
+                batch.append(request)
+                size += len(request.items)
+            self._queued_items -= size
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            started = time.perf_counter()
+            items = [x for request in batch for x in request.items]
+            for request in batch:
+                self.queue_waits.observe(started-request.enqueued)
+            self.batch_sizes.observe(len(items))
+            try:
+                results = self.fn(items)
+                offset = 0
+                for request in batch:
+                    request.result = results[offset:offset+len(request.items)]
+                    offset += len(request.items)
+            except BaseException as e:  # every request in the batch gets the error, the worker keeps going
+                logger.exception(f'{self.name} batch of {len(items)} failed')
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+    def stats(self) -> dict:
+        """ Batch size and queue wait histograms, with the current queue length """
+        with self._not_empty:
+            queued = self._queued_items
+        return {'max_batch_size': self.max_batch_size, 'max_wait': self.max_wait, 'queued_items': queued,
+                'batch_sizes': self.batch_sizes.as_dict(), 'queue_waits': self.queue_waits.as_dict()}
@@ -0,0 +1,187 @@
+""" two-tier django cache backend, a bounded in-process LRU in front of a shared backend """
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+_MISSING = object()
+SHARED_ONLY_PREFIX = 'shared:'  # keys starting with this skip the LRU, for coordination state every worker must see as soon as it is written
+
+
+class TieredCache(BaseCache):
+    """ Cache backend that keeps recently used entries pickled in a per-process LRU and falls through to a shared backend, ie the DatabaseCache
+
+    Reads are served from the LRU when possible and copied into it from the shared backend otherwise, writes go to both.
+    The LRU is bounded by the total size of its pickled values and its entries live at most LOCAL_TIMEOUT seconds, so a write or delete made by another worker shows up here within that time.
+    clear empties the shared backend but only the LRU of this process, other workers drop their copies as they expire.
+    Keys starting with SHARED_ONLY_PREFIX are never kept in the LRU, ie job states and generation counters that must not be read stale.
+
+    OPTIONS:
+        SHARED_BACKEND (str): Import path of the shared backend, built with the same LOCATION and TIMEOUT. Defaults to the DatabaseCache.
+        LOCAL_MAX_BYTES (int): Size of the LRU in bytes of pickled values. Defaults to 64MB.
+        LOCAL_TIMEOUT (int): Longest an entry lives in the LRU, in seconds. Defaults to 300.
+    """
+
+    def __init__(self, location: str, params: dict):
+        options = dict(params.get('OPTIONS', {}))
+        shared_backend = options.pop('SHARED_BACKEND', 'django.core.cache.backends.db.DatabaseCache')
+        self.local_max_bytes = int(options.pop('LOCAL_MAX_BYTES', 64*1024*1024))
+        self.local_timeout = float(options.pop('LOCAL_TIMEOUT', 300))
+        super().__init__({**params, 'OPTIONS': options})
+        self.shared: BaseCache = import_string(shared_backend)(location, {**params, 'OPTIONS': options})
+        self._local: OrderedDict[str, tuple[float, bytes]] = OrderedDict()  # key to expiry and pickled value, least recently used first
+        self._local_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'shared_hits': 0, 'shared_misses': 0, 'evictions': 0, 'expirations': 0}
+
+    # * LRU
+
+    def _local_get(self, key: str):
+        """ Value of a made key from the LRU, _MISSING if absent or expired """
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._local_delete(key)
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return _MISSING
+            self._local.move_to_end(key)
+            self._stats['hits'] += 1
+        return pickle.loads(entry[1])
+
+    def _local_set(self, key: str, value, timeout=DEFAULT_TIMEOUT):
+        """ Store a value under a made key in the LRU, evicting the least recently used entries to stay under local_max_bytes """
+        expiry = time.time()+self.local_timeout
+        backend_expiry = self.get_backend_timeout(timeout)
+        if backend_expiry is not None:
+            expiry = min(expiry, backend_expiry)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local_delete(key)
+            if len(pickled) > self.local_max_bytes or expiry <= time.time():  # would evict everything else, or is already dead
+                return
+            self._local[key] = (expiry, pickled)
+            self._local_bytes += len(pickled)
+            while self._local_bytes > self.local_max_bytes:
+                evicted, (_, evicted_pickled) = self._local.popitem(last=False)
+                self._local_bytes -= len(evicted_pickled)
+                self._stats['evictions'] += 1
+
+    def _local_delete(self, key: str):
+        """ Drop a made key from the LRU, the caller must hold the lock """
+        entry = self._local.pop(key, None)
+        if entry is not None:
+            self._local_bytes -= len(entry[1])
+
+    def stats(self) -> dict:
+        """ Hit, miss, eviction and expiration counters of the LRU, with its current size """
+        with self._lock:
+            lookups = self._stats['hits']+self._stats['misses']
+            return {**self._stats, 'hit_rate': round(self._stats['hits']/lookups, 4) if lookups else None,
+                    'entries': len(self._local), 'bytes': self._local_bytes, 'max_bytes': self.local_max_bytes}
+
+    # * cache API
+
+    @staticmethod
+    def _shared_only(key) -> bool:
+        """ Whether a key bypasses the LRU and is always read from and written to the shared backend only """
+        return str(key).startswith(SHARED_ONLY_PREFIX)
+
+    def get(self, key, default=None, version=None):
+        if self._shared_only(key):
+            return self.shared.get(key, default, version=version)
+        made_key = self.make_and_validate_key(key, version=version)
+        value = self._local_get(made_key)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            with self._lock:
+                self._stats['shared_misses'] += 1
+            return default
+        with self._lock:
+            self._stats['shared_hits'] += 1
+        self._local_set(made_key, value)  # we dont know how long the shared entry has left, LOCAL_TIMEOUT bounds how stale our copy can get
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        to_fetch = []
+        for key in keys:
+            if self._shared_only(key):
+                to_fetch.append(key)
+                continue
+            value = self._local_get(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                to_fetch.append(key)
+            else:
+                found[key] = value
+        if to_fetch:  # a single round trip for everything the LRU did not have
+            fetched = self.shared.get_many(to_fetch, version=version)
+            with self._lock:
+                self._stats['shared_hits'] += len(fetched)
+                self._stats['shared_misses'] += len(to_fetch)-len(fetched)
+            for key, value in fetched.items():
+                if not self._shared_only(key):
+                    self._local_set(self.make_key(key, version=version), value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if not self._shared_only(key):
+            self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed and not self._shared_only(key):
+                self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and not self._shared_only(key):
+            self._local_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_and_validate_key(key, version=version)
+        with self._lock:  # next read refetches it along with its new timeout
+            self._local_delete(made_key)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        made_key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            self._local_delete(made_key)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._local_delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        made_key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            entry = self._local.get(made_key)
+            if entry is not None and entry[0] > time.time():
+                return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._local_bytes = 0
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
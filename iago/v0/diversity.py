@@ -0,0 +1,64 @@
+""" numpy-native diversity filtering and reranking of search results """
+import numpy as np
+
+
+def _cosine_similarity(vectors: np.ndarray) -> np.ndarray:
+    """ k x k cosine similarity of the given vectors, normalizing is cheap next to the matmul so we dont trust callers to have done it """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    return vectors @ vectors.T
+
+
+def min_distance_filter(vectors: np.ndarray, min_distance: float) -> np.ndarray:
+    """ Greedily keep results, in rank order, that are at least min_distance away from every result kept before them
+
+    Args:
+        vectors (np.ndarray): (k, d) vectors of the results, in rank order
+        min_distance (float): Minimum cosine distance between kept results. Ranges from 0 to 1, 0 keeping all results and 1 keeping only the first.
+
+    Returns:
+        np.ndarray: Positions in vectors of the results that were kept, in rank order
+    """
+    if len(vectors) == 0 or min_distance <= 0:
+        return np.arange(len(vectors))
+
+    too_close = _cosine_similarity(vectors) > 1-min_distance
+    removed = np.zeros(len(vectors), dtype=bool)
+    for i in range(len(vectors)):
+        if not removed[i]:  # a kept result removes everything ranked below it that is too close to it
+            removed[i+1:] |= too_close[i, i+1:]
+    return np.flatnonzero(~removed)
+
+
+def mmr(vectors: np.ndarray, scores: np.ndarray, mmr_lambda: float, n: int | None = None) -> np.ndarray:
+    """ Maximal Marginal Relevance, iteratively pick the result with the best trade-off of relevance to the query and novelty to what has been picked
+
+    https://www.cs.cmu.edu/~jgc/publication/The_Use_MMR_Diversity_Based_LTMIR_1998.pdf
+
+    Args:
+        vectors (np.ndarray): (k, d) vectors of the results
+        scores (np.ndarray): (k,) similarity of each result to the query
+        mmr_lambda (float): Ranges from 0 to 1, 1 is pure relevance (the original ranking) and 0 is pure diversity
+        n (int, optional): Number of results to pick. Defaults to all of them.
+
+    Returns:
+        np.ndarray: Positions in vectors of the picked results, in the order they were picked
+    """
+    k = len(vectors)
+    n = k if n is None else min(n, k)
+    if k == 0:
+        return np.arange(0)
+
+    similarity = _cosine_similarity(vectors)
+    relevance = mmr_lambda*np.asarray(scores, dtype=np.float32)
+    max_similarity = np.zeros(k, dtype=np.float32)  # similarity of each result to the closest one picked so far
+    available = np.ones(k, dtype=bool)
+    picked = np.empty(n, dtype=np.int64)
+    for step in range(n):
+        marginal = np.where(available, relevance - (1-mmr_lambda)*max_similarity, -np.inf)
+        i = int(np.argmax(marginal))
+        picked[step] = i
+        available[i] = False
+        np.maximum(max_similarity, similarity[i], out=max_similarity)
+    return picked
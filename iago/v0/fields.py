@@ -0,0 +1,56 @@
+""" custom model fields """
+import base64
+
+import numpy as np
+from django.db import models
+
+
+class EmbeddingField(models.BinaryField):
+    """ A vector stored as its raw little-endian float32 bytes in a bytea
+
+    Half the size of a double precision[], which is 8 bytes per dimension plus the array header, and read straight into numpy with frombuffer instead of through a python float per dimension.
+    Values read from the database are read-only float32 arrays, anything array-like can be assigned.
+    """
+    description = 'float32 vector'
+
+    def __init__(self, *args, dimensions: int | None = None, **kwargs):
+        self.dimensions = dimensions
+        kwargs.setdefault('editable', True)  # BinaryField is not editable by default
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dimensions is not None:
+            kwargs['dimensions'] = self.dimensions
+        if self.editable:  # our default, unlike BinaryField
+            kwargs.pop('editable', None)
+        else:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype='<f4')
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):  # from value_to_string, ie fixtures
+            value = base64.b64decode(value.encode('ascii'))
+        if isinstance(value, (bytes, memoryview)):
+            return np.frombuffer(value, dtype='<f4')
+        return np.asarray(value, dtype=np.float32)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or isinstance(value, (bytes, memoryview)):
+            return value
+        vector = np.asarray(value, dtype='<f4')
+        if vector.ndim != 1 or (self.dimensions is not None and len(vector) != self.dimensions):
+            raise ValueError(f'{self.name} takes vectors of {self.dimensions} dimensions, got shape {vector.shape}')
+        return vector.tobytes()
+
+    def value_to_string(self, obj):
+        value = self.get_prep_value(self.value_from_object(obj))
+        return None if value is None else base64.b64encode(value).decode('ascii')
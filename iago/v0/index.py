@@ -1,215 +1,1286 @@
+import contextlib
+import dataclasses
+import fcntl
+import itertools
+import json
 import logging
+import os
+import threading
 import time
+import uuid
+from collections.abc import Callable
 from pathlib import Path
 
 import faiss
 import numpy as np
 from django.core.cache import cache
-from django.db.models import Model, Q
+from django.db import connection
+from django.db.models import DecimalField, FloatField, IntegerField, Model, Q, UUIDField
 from django.db.models.query import QuerySet
-from iago.settings import DEBUG, MODEL_VECTOR_SIZE
-from pathos.threading import ThreadPool
-from sentence_transformers import util
+from iago.settings import DEBUG, INDEX_OVERRIDES, INDEX_SNAPSHOT_DIR, MODEL_VECTOR_SIZE
+from rest_framework import status
+from rest_framework.exceptions import APIException
 
+from v0 import diversity
 from v0.ai import embedding_model
+from v0.cache import SHARED_ONLY_PREFIX
 from v0.models import Content, Job, MindtoolsSkillGroup, MindtoolsSkillSubgroup, Skill, Topic, UnsplashPhoto
-from v0.utils import generate_cache_key
+from v0.singleflight import SingleFlight
+from v0.utils import generate_cache_key, get_hash, vector_cache_key
 
 HERE = Path(__file__).parent
 logger = logging.getLogger(__name__)
 
+os.makedirs(INDEX_SNAPSHOT_DIR, exist_ok=True)
+
+# bump this whenever the on-disk layout of a snapshot changes so that old snapshots are rebuilt instead of misread
+SNAPSHOT_VERSION = 5
+
+# rows fetched per round trip from the server-side cursor when loading an index, bounds how many embeddings exist as python lists at once
+LOAD_CHUNK_SIZE = 2000
+
+# how often, in seconds, a query checks whether another worker on the host rebuilt the snapshot of its index
+SNAPSHOT_CHECK_INTERVAL = 10
+
+# compact an index once this fraction of its rows are tombstones left behind by upserts and removals
+COMPACTION_RATIO = 0.1
+
+# part of the cache key of every cached ranking, bump it whenever the cached rankings change shape or meaning
+QUERY_CACHE_VERSION = 6
+
+# how long, in seconds, a worker reuses the cache generation it last read instead of asking the shared cache on every query, bounds how late it sees an invalidation by another worker
+CACHE_GENERATION_INTERVAL = 5
+
+# most candidates a diversified search oversamples to, min_distance and mmr are quadratic in the candidates so this bounds their time and memory
+DIVERSITY_MAX_CANDIDATES = 1000
+
+# indexes declared with the 'auto' factory stay brute force below this many vectors and switch to IVF above it
+AUTO_FACTORY_MAX_FLAT = 50000
+
+
+def auto_factory(n: int) -> tuple[str, dict]:
+    """ Pick a FAISS factory string and search params for an index of n vectors
+
+    Brute force is exact and plenty fast for small indexes, past that we use IVF with the usual 4*sqrt(n) lists so search stays sub-linear.
+    https://github.com/facebookresearch/faiss/wiki/Guidelines-to-choose-an-index
+    """
+    if n < AUTO_FACTORY_MAX_FLAT:
+        return 'Flat', {}
+    nlist = int(4*np.sqrt(n))
+    return f'IVF{nlist},Flat', {'nprobe': max(1, nlist//32)}
+
+
+def encode_attribute(values: list, vocab: dict | None) -> np.ndarray:
+    """ Encode a column of attribute values into a compact array
+
+    Categorical columns, the ones with a vocab, become int32 codes with -1 for null, growing the vocab with any value it has not seen.
+    Numeric columns, vocab None, become float32 with nan for null so that comparisons against null are always False like in SQL.
+    """
+    if vocab is None:
+        return np.array([np.nan if x is None else x for x in values], dtype=np.float32)
+    return np.array([-1 if x is None else vocab.setdefault(x, len(vocab)) for x in values], dtype=np.int32)
+
+
+def encode_pks(pks: list, kind: str) -> np.ndarray:
+    """ Encode pks into a flat numpy array, UUIDs as their 16 bytes, integers as int64 and anything else as utf-8 bytes as wide as the longest one """
+    if kind == 'uuid':
+        return np.array([(x if isinstance(x, uuid.UUID) else uuid.UUID(str(x))).bytes for x in pks], dtype='S16')
+    if kind == 'int':
+        return np.array(pks, dtype=np.int64)
+    return np.array([str(x).encode('utf-8') for x in pks], dtype=bytes)
+
+
+class PkArray():
+    """ The pks of the rows of a generation, in a single sorted numpy array rather than a python object and a dict entry per row
+
+    Generations are built in pk order so finding the row of a pk is a binary search, and the array can be memory-mapped straight from the snapshot.
+    Pks of rows upserted since the build follow in a plain list and dict, compaction folds them back into the array.
+    """
+
+    def __init__(self, encoded: np.ndarray, kind: str):
+        self.kind = kind  # uuid, int or str, see encode_pks
+        self._base = encoded
+        self._upserted: list = []  # pks of the rows after the base ones, in row order
+        self._upserted_ids: dict = {}  # pk to its latest upserted row
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._upserted)
+
+    def __getitem__(self, i: int):
+        i = int(i)
+        if i < len(self._base):
+            return self._decode(self._base[i])
+        return self._upserted[i-len(self._base)]
+
+    def __iter__(self):
+        for x in self._base:
+            yield self._decode(x)
+        yield from self._upserted
+
+    def _decode(self, x):
+        if self.kind == 'uuid':
+            return uuid.UUID(bytes=bytes(x).ljust(16, b'\0'))  # numpy strips trailing null bytes
+        if self.kind == 'int':
+            return int(x)
+        return bytes(x).decode('utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        """ Approximate bytes held in memory, a memory-mapped base is paged in on demand so it does not count """
+        base = 0 if isinstance(self._base, np.memmap) else self._base.nbytes
+        return base + 200*len(self._upserted)  # a python pk in a list and a dict
+
+    def find(self, pks: list) -> np.ndarray:
+        """ Latest row of each pk, -1 for pks that were never in the generation, removed rows are not accounted for here """
+        ids = np.full(len(pks), -1, dtype=np.int64)
+        if len(self._base) and len(pks):
+            encoded = encode_pks(pks, self.kind)
+            positions = np.minimum(np.searchsorted(self._base, encoded), len(self._base)-1)
+            found = self._base[positions] == encoded
+            ids[found] = positions[found]
+        if self._upserted_ids:
+            for j, pk in enumerate(pks):
+                ids[j] = self._upserted_ids.get(pk, ids[j])
+        return ids
+
+    def append(self, pk) -> int:
+        """ Add the pk of a new row and return its row id """
+        i = len(self)
+        self._upserted.append(pk)
+        self._upserted_ids[pk] = i
+        return i
+
+    def forget(self, pk):
+        """ Stop resolving pk to its upserted row, once that row is removed """
+        self._upserted_ids.pop(pk, None)
+
+    def encoded(self, ids: np.ndarray | None = None) -> np.ndarray:
+        """ The encoded pks of every row, or of the given row ids, for snapshots and compaction """
+        encoded = np.concatenate([self._base, encode_pks(self._upserted, self.kind)]) if self._upserted else self._base
+        return encoded if ids is None else encoded[ids]
+
+
+class IndexGeneration():
+    """ One build of a VectorIndex, the faiss index together with the pks, vectors and attributes of its rows
+
+    Rebuilds and compactions never modify the generation that is serving queries, they build a new one and swap it in, so a query keeps a consistent view of the generation it started on.
+    Upserts and removals are applied in place under the generation lock. Upserted rows are never added to faiss, whose files may be mapped read-only, they are searched exactly until the next compaction.
+    Flat generations have no faiss index at all, they are searched exactly with numpy straight over the vectors, which are usually memory-mapped from the snapshot and so shared by every worker on the host.
+    """
+
+    def __init__(self, id: int, index: faiss.Index | None, pks: PkArray, vectors: np.ndarray, attributes: dict[str, np.ndarray] | None = None, vocab: dict[str, dict | None] | None = None, index_type: str = 'Flat', auto_search_params: dict | None = None):
+        self.id = id
+        self.index = index
+        self.index_type = index_type  # the resolved factory string, differs from the factory of the VectorIndex when that is 'auto'
+        self.auto_search_params = auto_search_params or {}
+        self.created = time.time()
+        self.lock = threading.RLock()
+        self.pks = pks
+        self.d = vectors.shape[1]
+        self._vectors = vectors  # vectors of the rows present at build time, possibly memory-mapped
+        self._overflow = np.empty((0, self.d), dtype=np.float32)  # vectors of rows upserted since, grown geometrically so appends are amortized O(1)
+        self._n_overflow = 0
+        self.tombstones: set[int] = set()  # row ids that were removed or superseded but are still physically in the faiss index
+        self.attributes = attributes or {}  # per row attribute arrays, grown geometrically like _overflow so they can be longer than pks
+        self.vocab = vocab or {}  # category to code of each categorical attribute, None for numeric ones
+        self.fingerprint = ''  # fingerprint of the QuerySet the generation was built from, workers that built or mapped the same data share their cached rankings through it
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """ Vectors of every row in the index, including tombstoned ones, row i belongs to self.pks[i]. Copies when there are upserted rows, use get_vectors for lookups """
+        if self._n_overflow == 0:
+            return self._vectors
+        return np.concatenate([self._vectors, self._overflow[:self._n_overflow]])
+
+    @property
+    def ntotal(self) -> int:
+        """ Number of rows, including tombstoned ones """
+        return len(self.pks)
+
+    def _inner_index(self) -> faiss.Index:
+        """ The index that does the searching, under the IndexIDMap and any pre-transform, ie the IVF of an 'OPQ16,IVF1024,PQ16' factory """
+        index = faiss.downcast_index(self.index.index)
+        if isinstance(index, faiss.IndexPreTransform):
+            index = faiss.downcast_index(index.index)
+        return index
+
+    @property
+    def compressed(self) -> bool:
+        """ Whether faiss stores the vectors lossily, in which case rerank rescores candidates with the exact vectors """
+        if self.index is None:
+            return False
+        index = self._inner_index()
+        if index.d != self.d:  # ie reduced by a PCA pre-transform
+            return True
+        if isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        code_size = getattr(index, 'code_size', None)
+        return code_size is None or code_size < 4*self.d  # when faiss does not tell, assume lossy, rerank is then merely redundant
+
+    @property
+    def needs_compaction(self) -> bool:
+        # upserted rows cost an exact scan on top of the faiss search, flat generations scan everything exactly anyway so only their tombstones count
+        stale = len(self.tombstones) + (self._n_overflow if self.index is not None else 0)
+        return stale > COMPACTION_RATIO*len(self.pks)
+
+    def get_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """ Exact vectors of the given row ids, only reads the rows asked for when the vectors are memory-mapped """
+        ids = np.asarray(ids, dtype=np.int64)
+        n_base = len(self._vectors)
+        if self._n_overflow == 0 or (ids < n_base).all():
+            return np.asarray(self._vectors[ids])
+        vectors = np.empty((len(ids), self.d), dtype=np.float32)
+        base = ids < n_base
+        vectors[base] = self._vectors[ids[base]]
+        vectors[~base] = self._overflow[ids[~base]-n_base]
+        return vectors
+
+    def row_ids(self, pks: list) -> np.ndarray:
+        """ Row of each pk, -1 for pks that are not in the generation or were removed """
+        ids = self.pks.find(pks)
+        if self.tombstones:
+            ids[np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))] = -1
+        return ids
+
+    def row_id(self, pk) -> int:
+        """ Row of a pk, -1 if it is not in the generation or was removed """
+        return int(self.row_ids([pk])[0])
+
+    def holds(self, pk, vector: np.ndarray, attributes: dict | None = None) -> bool:
+        """ Whether pk is indexed with exactly this vector and these attribute values, upserting it again would only leave a tombstone behind """
+        with self.lock:
+            i = self.row_id(pk)
+            if i == -1 or not np.array_equal(self.get_vectors([i])[0], vector.reshape(-1)):
+                return False
+            for name, column in self.attributes.items():
+                value, vocab = (attributes or {}).get(name), self.vocab[name]
+                if vocab is None:  # numeric, nan for null
+                    if not np.array_equal(column[i:i+1], np.array([np.nan if value is None else value], dtype=np.float32), equal_nan=True):
+                        return False
+                elif column[i] != (-1 if value is None else vocab.get(value, -2)):  # -2 is no code, a value the vocab has not seen yet
+                    return False
+            return True
+
+    def live_ids(self) -> np.ndarray:
+        """ Row ids that are not tombstones """
+        return np.array([i for i in range(len(self.pks)) if i not in self.tombstones], dtype=np.int64)
+
+    def memory_usage(self) -> dict[str, int]:
+        """ Approximate bytes held in memory by the faiss index and by our copy of the vectors, memory-mapped vectors are paged in on demand so they dont count """
+        vectors_bytes = 0 if isinstance(self._vectors, np.memmap) else self._vectors.nbytes
+        index_bytes = 0 if self.index is None else faiss.serialize_index(self.index).nbytes
+        return {'index': index_bytes, 'vectors': vectors_bytes + self._overflow.nbytes, 'pks': self.pks.nbytes, 'attributes': sum(x.nbytes for x in self.attributes.values())}
+
+    def upsert(self, pk, vector: np.ndarray, attributes: dict | None = None):
+        """ Append a row for pk, tombstoning the row it had before if any """
+        with self.lock:
+            old = self.row_id(pk)
+            if old != -1:  # the old row stays in faiss as a tombstone until the next compaction
+                self.tombstones.add(old)
+
+            i = len(self.pks)
+            if self._n_overflow == len(self._overflow):
+                overflow = np.empty((max(64, 2*len(self._overflow)), self.d), dtype=np.float32)
+                overflow[:self._n_overflow] = self._overflow
+                self._overflow = overflow
+            self._overflow[self._n_overflow] = vector
+            self._n_overflow += 1
+            for name, column in self.attributes.items():
+                if i == len(column):
+                    column = self.attributes[name] = np.concatenate([column, np.empty(max(64, len(column)), dtype=column.dtype)])
+                column[i] = encode_attribute([(attributes or {}).get(name)], self.vocab[name])[0]
+            self.pks.append(pk)
+
+    def remove(self, pk) -> bool:
+        """ Tombstone the row of pk, returns False if the pk is not in this generation """
+        with self.lock:
+            i = self.row_id(pk)
+            if i == -1:
+                return False
+            self.tombstones.add(i)
+            self.pks.forget(pk)
+        return True
+
+    def filter_mask(self, filters: dict) -> np.ndarray:
+        """ Evaluate Django style attribute filters, ie {'type__in': ['article'], 'content_read_seconds__range': (60, 600)}, into a mask of the live rows that pass them all """
+        n = len(self.pks)
+        mask = np.ones(n, dtype=bool)
+        for key, value in filters.items():
+            name, _, lookup = key.partition('__')
+            lookup = lookup or 'exact'
+            if name not in self.attributes:
+                raise ValueError(f'{name} is not a filterable attribute of this index, filterable attributes are {tuple(self.attributes)}')
+            column, vocab = self.attributes[name][:n], self.vocab[name]
+
+            if vocab is not None and lookup in ('exact', 'in'):  # categories are compared by code, a value we have never seen matches nothing
+                values = [value] if lookup == 'exact' else value
+                mask &= np.isin(column, [vocab[x] for x in values if x in vocab])
+            elif vocab is None and lookup in ('exact', 'in'):
+                mask &= np.isin(column, [value] if lookup == 'exact' else value)
+            elif vocab is None and lookup == 'range':
+                mask &= (column >= value[0]) & (column <= value[1])
+            elif vocab is None and lookup in ('gt', 'gte', 'lt', 'lte'):
+                mask &= {'gt': np.greater, 'gte': np.greater_equal, 'lt': np.less, 'lte': np.less_equal}[lookup](column, value)
+            else:
+                raise ValueError(f'Unsupported lookup {lookup} for the {name} attribute')
+        mask[list(self.tombstones)] = False
+        return mask
+
+    def search_selected(self, query_vectors: np.ndarray, k: int, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ Search faiss for the k closest rows of each query vector among only the rows set in mask, so filtered searches need no overfetching """
+        bitmap = np.packbits(mask, bitorder='little')  # must outlive the search, faiss only holds a pointer to it
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        index = self._inner_index()
+        if isinstance(index, faiss.IndexIVF):  # passing params overrides the ones set on the index, so carry those over
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        elif isinstance(index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        values, indices = self.index.search(query_vectors, k, params=params)
+
+        # IVF and HNSW only visit part of the index, so a selective filter can leave them short of k, brute force those queries over just the selected rows
+        short = (indices != -1).sum(axis=1) < min(k, int(mask.sum()))
+        if short.any():
+            selected = np.flatnonzero(mask)
+            scores = query_vectors[short] @ self.get_vectors(selected).T
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+            values[short], indices[short] = -np.inf, -1
+            values[short, :order.shape[1]] = np.take_along_axis(scores, order, axis=1)
+            indices[short, :order.shape[1]] = selected[order]
+        return values, indices
+
+    def _exact_search(self, query_vectors: np.ndarray, k: int, vectors: np.ndarray, offset: int, mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """ Exact top k of each query vector among the rows offset to offset+len(vectors) with numpy, skipping tombstones and rows not set in mask
+
+        BLAS reads memory-mapped vectors in place, so unlike a faiss flat index this needs no private copy of them.
+        """
+        scores = query_vectors @ vectors.T
+        if mask is not None:
+            scores[:, ~mask[offset:offset+len(vectors)]] = -np.inf
+        else:
+            scores[:, [i-offset for i in self.tombstones if offset <= i < offset+len(vectors)]] = -np.inf
+        k = min(k, len(vectors))
+        if k == 0:
+            return np.empty((len(query_vectors), 0), dtype=np.float32), np.empty((len(query_vectors), 0), dtype=np.int64)
+        top = np.argpartition(-scores, k-1, axis=1)[:, :k]
+        values = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-values, axis=1, kind='stable')
+        values, indices = np.take_along_axis(values, order, axis=1), np.take_along_axis(top, order, axis=1)+offset
+        indices[np.isneginf(values)] = -1
+        return values, indices
+
+    def search(self, query_vectors: np.ndarray, n: int, filters: dict | None = None, rerank: int = 0) -> list[tuple[np.ndarray, np.ndarray]]:
+        """ Search for the n closest live rows of each query vector in a single call, skipping tombstones and rows that fail the filters
+
+        If rerank is set, rerank times more candidates are fetched from the compressed index and rescored with the exact vectors.
+
+        Returns:
+            list[tuple[np.ndarray, np.ndarray]]: Per query vector, the similarities and row ids of its matches, row id -1 where there is no match
+        """
+        fetch = n*rerank if rerank else n
+        with self.lock:
+            mask = self.filter_mask(filters) if filters else None  # tombstones are cleared in the mask
+            n_base = len(self._vectors)
+            if self.index is None:
+                values, indices = self._exact_search(query_vectors, fetch, self._vectors, 0, mask)
+            elif mask is not None:
+                values, indices = self.search_selected(query_vectors, fetch, mask[:n_base])
+            else:  # at most len(tombstones) of the results can be dead, so fetching that many extra guarantees n live ones
+                values, indices = self.index.search(query_vectors, fetch+len(self.tombstones))
+
+            if self._n_overflow:  # rows upserted since the build are not in faiss, there are few of them so search them exactly and merge
+                overflow_values, overflow_indices = self._exact_search(query_vectors, fetch, self._overflow[:self._n_overflow], n_base, mask)
+                values, indices = np.concatenate([values, overflow_values], axis=1), np.concatenate([indices, overflow_indices], axis=1)
+                order = np.argsort(-values, axis=1, kind='stable')
+                values, indices = np.take_along_axis(values, order, axis=1), np.take_along_axis(indices, order, axis=1)
+            tombstones = set(self.tombstones) if mask is None else set()
+        if not tombstones and not rerank:
+            return [(row_values[:n], row_indices[:n]) for row_values, row_indices in zip(values, indices)]
+
+        results = []
+        for query_vector, row_values, row_indices in zip(query_vectors, values, indices):
+            live = [j for j, x in enumerate(row_indices) if x not in tombstones and x != -1]
+            row_values, row_indices = row_values[live], row_indices[live]
+            if rerank:  # exact inner product against only the candidates, they are few so this is cheap even from a memory map
+                exact = self.get_vectors(row_indices) @ query_vector
+                order = np.argsort(-exact, kind='stable')
+                row_values, row_indices = exact[order], row_indices[order]
+            results.append((row_values[:n], row_indices[:n]))
+        return results
+
+
+class IndexWarming(APIException):
+    """ Raised when querying an index that is not loaded yet, DRF turns it into a 503 so clients and the load balancer know to retry """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Index is warming up, try again shortly'
+    default_code = 'index_warming'
+
+
+class RebuildJob():
+    """ Status and timing of a background rebuild, saved to the cache so that any worker can report on it """
+
+    def __init__(self, index_name: str):
+        self.id = uuid.uuid4().hex
+        self.index = index_name
+        self.status = 'queued'  # queued, running, succeeded or failed
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.seconds: float | None = None
+        self.generation: int | None = None
+        self.ntotal: int | None = None
+        self.error: str | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def save(self):
+        cache.set(SHARED_ONLY_PREFIX+generate_cache_key('rebuild_job', self.id), self.as_dict(), timeout=60*60*24)  # 1 day timeout, shared only so any worker reports the current state
+
+
+def get_rebuild_job(job_id: str) -> dict | None:
+    """ Status of a rebuild job by its id, None if it does not exist or has expired """
+    return cache.get(SHARED_ONLY_PREFIX+generate_cache_key('rebuild_job', job_id))
+
 
 class VectorIndex():
     """ Index class for semantic embedding and implementing vector search """
 
-    def __init__(self, queryset: QuerySet, generate_index=True):
+    def __init__(self, queryset: QuerySet, generate_index=True, name: str | None = None, factory: str = 'Flat', search_params: dict | None = None, rerank: int = 0, attributes: tuple[str, ...] = (),
+                 cache_timeout: int = 60*60*24*2, memory_budget: int | None = None):
+        """
+        Args:
+            queryset (QuerySet): Objects to index, their model must have an embedding_all_mpnet_base_v2 field
+            generate_index (bool, optional): Whether to load or generate the index right away. Defaults to True.
+            name (str, optional): Unique name of the index, used for its snapshot files. Defaults to the lowercased model name.
+            factory (str, optional): FAISS index_factory string, ie 'Flat', 'IVF1024,Flat' or 'HNSW32,Flat', or 'auto' to pick by size. Defaults to 'Flat'.
+            search_params (dict, optional): Search time params, ie {'nprobe': 16} for IVF or {'efSearch': 128} for HNSW. Defaults to None.
+            rerank (int, optional): For compressed factories like 'SQ8' or 'IVF1024,PQ96', fetch rerank times more candidates and rescore them with the exact vectors. Defaults to 0, no rerank.
+            attributes (tuple[str, ...], optional): Model fields to keep per row in memory so that queries can filter on them inside the search, ie ('provider', 'type'). Defaults to none.
+            cache_timeout (int, optional): How long query results are cached, in seconds. Defaults to 2 days.
+            memory_budget (int, optional): Bytes the index may hold in memory, a generation over it is logged and reported by status. Defaults to None, no budget.
+        """
         assert isinstance(queryset, QuerySet), 'VectorIndex only supports QuerySets'
         self.queryset = queryset
         self.model: Model = self.queryset.model
-        self.logger = logging.getLogger(f'v0.VectorIndex_{self.queryset.model.__name__}')
+        self.name = name or self.model.__name__.lower()  # used to name the snapshot files, so must be unique per index
+        self.factory = factory
+        self.search_params = search_params or {}
+        self.rerank = rerank
+        self.attributes = tuple(attributes)
+        self.cache_timeout = cache_timeout
+        self.memory_budget = memory_budget
+        self.logger = logging.getLogger(f'v0.VectorIndex_{self.name}')
         self.d = MODEL_VECTOR_SIZE
+        self.generation: IndexGeneration | None = None  # swapped wholesale, never modified by a rebuild, so grab it once per query
+        self._generation_ids = itertools.count(1)
+        self._lock = threading.RLock()  # orders writes against generation swaps so that no write is lost to a rebuild
+        self._rebuild_lock = threading.Lock()  # one rebuild at a time, a second one would only redo the same work
+        self._pending: list[tuple] | None = None  # writes made while a rebuild is running, replayed onto the new generation before it is swapped in
+        self._rebuild_job: RebuildJob | None = None
+        self._snapshot_mtime: int | None = None  # of the meta file we last read, a newer one means another worker rebuilt the snapshot
+        self._snapshot_checked = 0.0
+        self.state = 'cold'  # cold, warming, ready or failed, only ever leaves ready for failed if it never had a generation
+        self.error: str | None = None
+        self.warmed_seconds: float | None = None
+        self._state_changed = threading.Condition(self._lock)
+        # everything the cached rankings depend on that is fixed for the life of the index, hashed once here rather than rendering the SQL on every query
+        self._cache_namespace = get_hash((QUERY_CACHE_VERSION, embedding_model.name, embedding_model.max_seq_length, self.name, str(self.queryset.query), self.factory, self.search_params, self.rerank))
+        self._cache_generation_key = SHARED_ONLY_PREFIX+generate_cache_key('index_cache_generation', self.name)  # shared only, a worker holding an old one would serve invalidated results
+        self._cache_generation: tuple[float, int] | None = None  # when we last read the counter and its value, see CACHE_GENERATION_INTERVAL
+        self._in_flight = SingleFlight()  # identical rankings asked for at the same time are searched once
         if generate_index:
-            self._generate_index()
+            self.warm()
+
+    @property
+    def pks(self) -> list:
+        return self.generation.pks
+
+    @contextlib.contextmanager
+    def _snapshot_lock(self):
+        """ Exclusive lock on the snapshot of this index across every process on the host, so one worker builds it while the others wait and then map it """
+        with open(INDEX_SNAPSHOT_DIR/f'{self.name}.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def warm(self):
+        """ Load or generate the index in the calling thread, unless it is already ready or another thread is warming it """
+        with self._state_changed:
+            if self.state in ('warming', 'ready'):
+                return
+            self.state = 'warming'
+            self.error = None
 
-    def _generate_index(self):
-        """ Generate the FAISS IndexIDMap using the QuerySet """
         start = time.perf_counter()
-        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(self.d))  # dimensions of vectors
+        try:
+            self._load_or_generate_index()
+        except Exception as e:
+            self.logger.exception(f'Failed to warm {self.name}')
+            with self._state_changed:
+                self.state, self.error = ('ready', None) if self.generation is not None else ('failed', str(e))
+                self._state_changed.notify_all()
+            raise
+        self.warmed_seconds = round(time.perf_counter()-start, 3)
+
+    def warm_async(self):
+        """ Warm the index in a background thread, does nothing if it is already ready or warming """
+        if self.state in ('warming', 'ready'):
+            return
+        threading.Thread(target=_warm_quietly, args=(self,), name=f'warm_{self.name}', daemon=True).start()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """ Block until the index is ready, warming it in the calling thread if nobody else is, returns False if it failed or timed out. For scripts, requests should never wait on a build """
+        try:
+            self.warm()
+        except Exception:  # already logged, report it through the state
+            pass
+        with self._state_changed:
+            self._state_changed.wait_for(lambda: self.state != 'warming', timeout)
+        return self.state == 'ready'
+
+    def status(self) -> dict:
+        """ State of the index for the readiness endpoint """
+        generation = self.generation
+        memory = sum(generation.memory_usage().values()) if generation else None
+        return {'state': self.state, 'ntotal': generation.ntotal if generation else None, 'generation': generation.id if generation else None,
+                'warmed_seconds': self.warmed_seconds, 'error': self.error, 'memory': memory, 'memory_budget': self.memory_budget}
+
+    def _load_or_generate_index(self):
+        """ Load the index from its on-disk snapshot if it is still fresh, otherwise generate it from the QuerySet and snapshot it """
+        with self._lock:  # writes made while we load are replayed onto the generation we swap in
+            self._pending = []
+        try:
+            with self._snapshot_lock():
+                fingerprint = self._fingerprint()
+                if not self._load_snapshot(fingerprint):
+                    self._rebuild(fingerprint)
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def rebuild(self, fingerprint: str | None = None):
+        """ Regenerate the index from the QuerySet, overwrite its snapshot and swap the new generation in
 
-        # get vectors from the QuerySet
-        self.pks, self.vectors = zip(*list(self.queryset.values_list('pk', 'embedding_all_mpnet_base_v2')))
-        self.vectors = np.array(self.vectors).astype(np.float32)
+        Queries keep being served from the current generation while this runs, so memory briefly holds both. Use rebuild_async to not block the caller.
+        """
+        with self._snapshot_lock():
+            self._rebuild(fingerprint)
+
+    def _rebuild(self, fingerprint: str | None = None):
+        with self._rebuild_lock:
+            with self._lock:
+                if self._pending is None:  # unless a first load already collects them
+                    self._pending = []
+            try:
+                fingerprint = fingerprint or self._fingerprint()
+                generation = self._generate_index()
+                generation.fingerprint = fingerprint
+                if self._save_snapshot(generation, fingerprint):
+                    # serve from the mapped snapshot like every other worker on the host does, rather than keeping a private copy of what we just built
+                    generation = self._read_snapshot(fingerprint) or generation
+                self._swap(generation)
+                self.invalidate_cache()  # the fingerprint misses embeddings that changed in place, which is usually why a rebuild was asked for
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    def rebuild_async(self) -> RebuildJob:
+        """ Start a rebuild in a background thread and return its job right away, if one is already running for this index that job is returned instead """
+        with self._lock:
+            if self._rebuild_job is not None and self._rebuild_job.active:
+                return self._rebuild_job
+            job = self._rebuild_job = RebuildJob(self.name)
+            job.save()
+        threading.Thread(target=self._run_rebuild_job, args=(job,), name=f'rebuild_{self.name}', daemon=True).start()
+        return job
+
+    def _run_rebuild_job(self, job: RebuildJob):
+        job.status, job.started = 'running', time.time()
+        job.save()
+        try:
+            self.rebuild()
+            job.status, job.generation, job.ntotal = 'succeeded', self.generation.id, self.generation.ntotal
+        except Exception as e:  # the old generation keeps serving, so a failed rebuild is only reported
+            self.logger.exception(f'Rebuild job {job.id} of {self.name} failed')
+            job.status, job.error = 'failed', str(e)
+        finally:
+            connection.close()  # this thread opened its own db connection, dont leak it
+        job.finished = time.time()
+        job.seconds = round(job.finished-job.started, 3)
+        job.save()
+
+    def _swap(self, generation: IndexGeneration):
+        """ Atomically make generation the one that serves queries, after replaying onto it the writes made while it was being built """
+        with self._state_changed:
+            if self._pending is not None:
+                for pk, vector, attributes in self._pending:
+                    if vector is None:
+                        generation.remove(pk)
+                    else:
+                        generation.upsert(pk, vector, attributes)
+                self._pending = []  # anything written from here on lands on the new generation directly
+            self.generation = generation
+            self.state = 'ready'
+            self._state_changed.notify_all()
+        if self.memory_budget is not None:
+            memory = sum(generation.memory_usage().values())
+            if memory > self.memory_budget:  # reported rather than enforced, serving from a recompressed index is a deployment decision, see INDEX_OVERRIDES
+                self.logger.warning(f'{self.name} holds {memory/1e6:.1f}MB in memory, over its budget of {self.memory_budget/1e6:.1f}MB')
+
+    def _generate_index(self) -> IndexGeneration:
+        """ Generate a new generation of the index from the QuerySet """
+        start = time.perf_counter()
 
-        # add vectors to the index
-        self.index.add_with_ids(self.vectors, np.array(range(0, len(self.vectors))).astype(np.int64))
-        self.logger.info(f'Generated index for {self.queryset.model.__name__} with a total of {self.index.ntotal} vectors in {round(time.perf_counter()-start, 4)}s')
+        pks, vectors, columns = self._load_rows()
+        vocab = {name: None if self._is_numeric(name) else {} for name in self.attributes}
+        attributes = {name: encode_attribute(columns[name], vocab[name]) for name in self.attributes}
+        generation = self._build_generation(pks, vectors, attributes, vocab)
+        self.logger.info(f'Generated {generation.index_type} index for {self.queryset.model.__name__} with a total of {generation.ntotal} vectors in {round(time.perf_counter()-start, 4)}s')
+        return generation
 
-    def _min_distance(self, indices: list[int], min_distance: float):
-        """ Returns the indices that are a provided minimum semantic distance from each other in a given list of indices
+    def _load_rows(self) -> tuple[list, np.ndarray, dict[str, list]]:
+        """ Stream the pks, vectors and attributes of the QuerySet from a server-side cursor, writing the vectors straight into a preallocated float32 array
+
+        Only LOAD_CHUNK_SIZE embeddings are ever held decoded at once, instead of all of them, which is what used to dominate the memory and time of a build.
+
+        Returns:
+            pks (list): Primary keys in row order
+            vectors (np.ndarray): (n, d) float32 vectors in row order
+            columns (dict[str, list]): Raw values of each attribute in row order
+        """
+        n = self.queryset.count()
+        vectors = np.empty((n, self.d), dtype=np.float32)
+        pks = []
+        columns = {name: [] for name in self.attributes}
+        rows = self.queryset.values_list('pk', 'embedding_all_mpnet_base_v2', *self.attributes).iterator(chunk_size=LOAD_CHUNK_SIZE)
+        for i, (pk, vector, *values) in enumerate(rows):
+            if i == len(vectors):  # rows were inserted since we counted, rare so just grow
+                vectors = np.concatenate([vectors, np.empty((max(LOAD_CHUNK_SIZE, len(vectors)//2), self.d), dtype=np.float32)])
+            vectors[i] = vector
+            pks.append(pk)
+            for name, value in zip(self.attributes, values):
+                columns[name].append(value)
+        return pks, vectors[:len(pks)], columns
+
+    def _build_generation(self, pks: list | np.ndarray, vectors: np.ndarray, attributes: dict[str, np.ndarray] | None = None, vocab: dict[str, dict | None] | None = None) -> IndexGeneration:
+        """ Build a FAISS index of our factory type, train it if the type needs training, and add the vectors to it
+
+        The rows are first put in pk order so that PkArray can find them by binary search, the id of each vector is then its row in vectors and pks.
+        pks may be python pks or already encoded ones, ie from a compaction.
+        """
+        kind = self._pk_kind()
+        encoded = encode_pks(pks, kind) if not isinstance(pks, np.ndarray) else pks
+        order = np.argsort(encoded, kind='stable')
+        if (order != np.arange(len(order))).any():  # copies, but only while building
+            encoded, vectors = encoded[order], np.ascontiguousarray(vectors[order])
+            attributes = {name: column[order] for name, column in (attributes or {}).items()}
+        pks = PkArray(encoded, kind)
+
+        factory, search_params = auto_factory(len(vectors)) if self.factory == 'auto' else (self.factory, {})
+        if factory == 'Flat':  # searched exactly with numpy, a faiss flat index would only be a second copy of the vectors
+            return self._new_generation(None, pks, vectors, attributes, vocab, factory, search_params)
+        index = faiss.index_factory(self.d, factory, faiss.METRIC_INNER_PRODUCT)  # inner product of normalized vectors is cosine similarity
+        if not index.is_trained:  # ie IVF needs to learn its coarse centroids
+            start = time.perf_counter()
+            index.train(vectors)
+            self.logger.info(f'Trained {factory} index for {self.name} in {time.perf_counter()-start:.3f}s')
+        index = faiss.IndexIDMap(index)
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        return self._new_generation(index, pks, vectors, attributes, vocab, factory, search_params)
+
+    def _new_generation(self, index: faiss.Index | None, pks: PkArray, vectors: np.ndarray, attributes: dict[str, np.ndarray] | None, vocab: dict[str, dict | None] | None, index_type: str, auto_search_params: dict) -> IndexGeneration:
+        """ Wrap a faiss index in a generation with the next id, applying the search params, these are not all persisted by faiss so they are applied on every load """
+        parameter_space = faiss.ParameterSpace()
+        for key, value in ({**auto_search_params, **self.search_params} if index is not None else {}).items():
+            try:
+                parameter_space.set_index_parameter(index, key, value)
+            except RuntimeError:
+                self.logger.warning(f'{key} is not a valid search param for the {index_type} index of {self.name}')
+        return IndexGeneration(next(self._generation_ids), index, pks, vectors, attributes, vocab, index_type, auto_search_params)
+
+    def _pk_kind(self) -> str:
+        """ How pks are encoded in a PkArray, see encode_pks """
+        pk = self.model._meta.pk
+        if isinstance(pk, UUIDField):
+            return 'uuid'
+        if isinstance(pk, IntegerField):  # including the auto fields
+            return 'int'
+        return 'str'
+
+    def _is_numeric(self, name: str) -> bool:
+        """ Whether an attribute is filtered as a number (ranges and comparisons) rather than as a category (equality) """
+        return isinstance(self.model._meta.get_field(name), (IntegerField, FloatField, DecimalField))
+
+    def upsert(self, pk, vector: list[float] | np.ndarray, attributes: dict | None = None, invalidate: bool = True) -> bool:
+        """ Add a vector to the index, or replace it if the pk is already indexed, without rebuilding the index
 
         Args:
-            indices (list): List of index values of the embeddings to ensure min_distance between
-            min_distance (float,): Minimum distance between embeddings. Ranges from 0 to 1, 0 returning all results and 1 returning none.
+            pk: Primary key of the object the vector belongs to
+            vector (list[float] | np.ndarray): The embedding of the object
+            attributes (dict, optional): Values of the attributes of the index for the object, missing ones are stored as null. Defaults to None.
+            invalidate (bool, optional): Whether to invalidate the cached rankings if the index changed, bulk updates pass False and invalidate once at the end. Defaults to True.
 
         Returns:
-            results list([int]): List of indexes that are outside the min_distance
-            results_to_remove set([int]): Set of index values (i) that got removed from incides
+            bool: Whether the index changed, False if the pk was already indexed with this vector and these attributes
         """
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, self.d)
+        with self._lock:
+            if self._pending is not None:  # a build is running, it replays this onto the generation it swaps in
+                self._pending.append((pk, vector, attributes))
+            if self.generation is None:  # nothing to update yet, the object is picked up or replayed when the index gets generated
+                return False
+            if self.generation.holds(pk, vector, attributes):
+                return False
+            self.generation.upsert(pk, vector, attributes)
+            self._maybe_compact()
+        if invalidate:  # cached rankings would otherwise miss the new row, or keep its old attributes, until they expire
+            self.invalidate_cache()
+        return True
+
+    def remove(self, pk, invalidate: bool = True) -> bool:
+        """ Remove a pk from the index without rebuilding it, returns False if the pk was not indexed, see upsert for invalidate """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((pk, None, None))
+            if self.generation is None:
+                return False
+            removed = self.generation.remove(pk)
+            self._maybe_compact()
+        if removed and invalidate:  # cached rankings would still return it, hydrating drops it only once the row is gone from the database
+            self.invalidate_cache()
+        return removed
 
+    def _maybe_compact(self):
+        if self.generation.needs_compaction:
+            self.compact()
+
+    def compact(self):
+        """ Physically drop tombstoned rows by building a new generation from the in-memory vectors, does not touch the database """
+        start = time.perf_counter()
+        with self._lock:
+            generation = self.generation
+            live = generation.live_ids()
+            vectors = generation.get_vectors(live)
+            pks = generation.pks.encoded(live)
+            attributes = {name: column[live] for name, column in generation.attributes.items()}
+            self.generation = self._build_generation(pks, vectors, attributes, generation.vocab)
+            self.generation.fingerprint = generation.fingerprint  # same data, minus rows that cached rankings are already filtered of
+        self.logger.info(f'Compacted {self.name}, dropped {len(generation.tombstones)} tombstones in {time.perf_counter()-start:.3f}s')
+
+    def _fingerprint(self) -> str:
+        """ Cheap deterministic summary of what the QuerySet currently contains, used to tell if a snapshot is stale
+
+        We only hash the SQL and what the index stores besides the vectors, the pk and the attribute values of each row, pulling every embedding to compare would defeat the purpose of the snapshot.
+        Saves that touch no attribute leave it unchanged, embeddings of existing rows are not expected to change, if they do, hit the rebuild endpoint which overwrites the snapshot.
+        """
+        rows = sorted((str(pk), *values) for pk, *values in self.queryset.values_list('pk', *self.attributes))
+        return generate_cache_key(SNAPSHOT_VERSION, self.factory, self.attributes, str(self.queryset.query), rows)  # changing the index type or attributes invalidates the snapshot too
+
+    def _snapshot_paths(self) -> dict[str, Path]:
+        """ Paths of the files that make up the snapshot of this index """
+        return {
+            'meta': INDEX_SNAPSHOT_DIR/f'{self.name}.json',
+            'index': INDEX_SNAPSHOT_DIR/f'{self.name}.faiss',
+            'pks': INDEX_SNAPSHOT_DIR/f'{self.name}.pks.npy',
+            'vectors': INDEX_SNAPSHOT_DIR/f'{self.name}.vectors.npy',
+            'attributes': INDEX_SNAPSHOT_DIR/f'{self.name}.attributes.npz',
+        }
+
+    def _save_snapshot(self, generation: IndexGeneration, fingerprint: str) -> bool:
+        """ Write the FAISS index, the pk mapping, the vectors and the attributes of a generation to disk, the meta file is written last so a partially written snapshot is never loaded, returns False if it failed """
+        start = time.perf_counter()
+        paths = self._snapshot_paths()
+        try:
+            with generation.lock:
+                # write everything to temp files first and then atomically move them into place
+                keys = ['pks', 'vectors', 'attributes']
+                if generation.index is not None:  # flat generations have no faiss index, they search the vectors directly
+                    faiss.write_index(generation.index, str(paths['index'])+'.tmp')
+                    keys.append('index')
+                with open(str(paths['pks'])+'.tmp', 'wb') as f:
+                    np.save(f, generation.pks.encoded())
+                with open(str(paths['vectors'])+'.tmp', 'wb') as f:
+                    np.save(f, generation.vectors)
+                with open(str(paths['attributes'])+'.tmp', 'wb') as f:
+                    np.savez(f, **{name: column[:len(generation.pks)] for name, column in generation.attributes.items()})
+                meta = {'version': SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'model': self.model.__name__, 'ntotal': generation.ntotal, 'created': time.time(),
+                        'index_type': generation.index_type, 'faiss': generation.index is not None, 'auto_search_params': generation.auto_search_params, 'pk_kind': generation.pks.kind,
+                        'vocab': {name: None if vocab is None else list(vocab) for name, vocab in generation.vocab.items()}}  # codes are positions in the list
+            for key in keys:
+                os.replace(str(paths[key])+'.tmp', paths[key])
+
+            with open(str(paths['meta'])+'.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(str(paths['meta'])+'.tmp', paths['meta'])
+            self.logger.info(f'Saved snapshot of {self.name} in {time.perf_counter()-start:.3f}s')
+            return True
+        except OSError as e:  # a missing snapshot only costs us a rebuild on next boot, so never let it take the index down
+            self.logger.error(f'Failed to save snapshot of {self.name}: {e}')
+            return False
+
+    def _load_snapshot(self, fingerprint: str) -> bool:
+        """ Load the index from its snapshot and swap it in, returns False if there is no usable snapshot """
+        generation = self._read_snapshot(fingerprint)
+        if generation is None:
+            return False
+        self._swap(generation)
+        return True
+
+    def _check_snapshot(self):
+        """ Remap the snapshot in the background if another worker on the host rebuilt it since we read it, at most every SNAPSHOT_CHECK_INTERVAL seconds
+
+        Only the worker that ran a rebuild swaps in its generation, the others find out here, through the mtime of the meta file which is replaced last.
+        """
+        now = time.monotonic()
+        if now-self._snapshot_checked < SNAPSHOT_CHECK_INTERVAL:
+            return
+        self._snapshot_checked = now
+        try:
+            mtime = os.stat(self._snapshot_paths()['meta']).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._snapshot_mtime and not self._rebuild_lock.locked():  # while we rebuild, the new meta file is ours
+            threading.Thread(target=self._remap_snapshot, name=f'remap_{self.name}', daemon=True).start()
+
+    def _remap_snapshot(self):
+        """ Swap in the generation of the current snapshot, trusting its fingerprint since the worker that wrote it just computed it """
+        with self._snapshot_lock(), self._rebuild_lock:  # the snapshot files are complete while we hold the lock
+            if self._snapshot_mtime == os.stat(self._snapshot_paths()['meta']).st_mtime_ns:  # another query got here first
+                return
+            generation = self._read_snapshot()
+            if generation is not None:
+                self._swap(generation)
+                self.logger.info(f'Swapped in the snapshot of {self.name} rebuilt by another worker')
+
+    def _read_snapshot(self, fingerprint: str | None = None) -> IndexGeneration | None:
+        """ Map a generation from the snapshot files, returns None if there is no usable snapshot
+
+        The vectors and the inverted lists of IVF indexes are memory-mapped read-only, so their pages live once in the OS page cache and are shared by every worker on the host. Other faiss index types, ie HNSW, are read into the memory of each worker.
+        fingerprint is the one the snapshot must have to be fresh, None to take whichever it has.
+        """
         start = time.perf_counter()
-        # get actual vectors of the results
-        # https://www.pinecone.io/learn/faiss-tutorial/
-        # we have k vectors to return - so we initialize a zero array to hold them
-        vectors = np.array([self.vectors[x] for x in indices[0]])
+        paths = self._snapshot_paths()
+        try:
+            with open(paths['meta']) as f:
+                self._snapshot_mtime = os.fstat(f.fileno()).st_mtime_ns  # even if the snapshot turns out unusable, so we do not retry it on every check
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self.logger.info(f'No snapshot found for {self.name}')
+            return None
+        fingerprint = fingerprint or meta.get('fingerprint')
+
+        if meta.get('version') != SNAPSHOT_VERSION or meta.get('fingerprint') != fingerprint or meta.get('model') != self.model.__name__ or meta.get('pk_kind') != self._pk_kind():
+            self.logger.info(f'Snapshot of {self.name} is stale')
+            return None
+
+        try:
+            index = faiss.read_index(str(paths['index']), faiss.IO_FLAG_MMAP) if meta['faiss'] else None
+            vectors = np.load(paths['vectors'], mmap_mode='r')  # memory-mapped, pages are only read when a vector is actually used
+            pks = PkArray(np.load(paths['pks'], mmap_mode='r'), meta['pk_kind'])  # already encoded and in pk order, so mapped as is
+            with np.load(paths['attributes']) as f:
+                attributes = {name: f[name] for name in self.attributes}
+            vocab = {name: None if values is None else {x: i for i, x in enumerate(values)} for name, values in meta['vocab'].items()}
+        except (OSError, RuntimeError, ValueError, KeyError) as e:
+            self.logger.warning(f'Failed to load snapshot of {self.name}: {e}')
+            return None
+
+        if not len(pks) == len(vectors) == meta['ntotal'] or (index is not None and index.ntotal != len(pks)) or any(len(x) != len(pks) for x in attributes.values()):
+            self.logger.warning(f'Snapshot of {self.name} is inconsistent')
+            return None
+
+        generation = self._new_generation(index, pks, vectors, attributes, vocab, meta['index_type'], meta['auto_search_params'])
+        generation.fingerprint = fingerprint
+        self.logger.info(f'Mapped {meta["index_type"]} index for {self.name} from snapshot with a total of {generation.ntotal} vectors in {time.perf_counter()-start:.3f}s')
+        return generation
 
-        # Compute cosine-similarities for each vector with each other vector
-        # https://www.sbert.net/docs/usage/semantic_textual_similarity.html
-        cosine_scores = np.array(util.cos_sim(vectors, vectors))
+    def cache_generation(self, fresh: bool = False) -> int:
+        """ Counter shared by every worker through the cache and folded into the cache keys of our rankings, bumped by invalidate_cache
 
-        # get the indices of the vectors that are outside the min_distance
-        results_to_remove = set()
-        for i, vector_results in enumerate(cosine_scores):
-            for j, result in enumerate(vector_results):
-                if i not in results_to_remove and j not in results_to_remove and i != j and 1-result < min_distance:  # don't compare to self, and dont compare to already removed results
-                    results_to_remove.add(j)
+        The value last read is reused for CACHE_GENERATION_INTERVAL seconds so that rankings served from the local tier cost no round trip to the shared one, fresh always reads the shared counter.
+        """
+        read = self._cache_generation
+        if not fresh and read is not None and time.monotonic()-read[0] < CACHE_GENERATION_INTERVAL:
+            return read[1]
+        cache_generation = cache.get(self._cache_generation_key)
+        if cache_generation is None:  # first use, or the counter was culled, so start past any generation rankings may still be cached under
+            cache.add(self._cache_generation_key, int(time.time()), timeout=None)
+            cache_generation = cache.get(self._cache_generation_key, 0)
+        self._cache_generation = (time.monotonic(), cache_generation)
+        return cache_generation
+
+    def invalidate_cache(self) -> int:
+        """ Orphan every cached ranking of this index, and only of this index, by bumping its cache generation
 
-        # get indices in the global index of the results we want to keep
-        cleaned_indices = [int(x) for i, x in enumerate(indices[0]) if i not in results_to_remove]
-        # self.logger.debug(f'Performed min_dist and got {len(cleaned_indices)} vectors in {round(time.perf_counter()-start, 4)}s')
+        Nothing is deleted, the superseded entries are simply never read again and are culled by the cache along with expired ones.
 
-        return cleaned_indices, results_to_remove
+        Returns:
+            int: The new cache generation
+        """
+        # not cache.incr, it is a get and a set with the default timeout, which would let the counter expire and be reseeded
+        cache_generation = self.cache_generation(fresh=True)+1
+        cache.set(self._cache_generation_key, cache_generation, timeout=None)
+        self._cache_generation = (time.monotonic(), cache_generation)  # this worker sees its own invalidation right away
+        self.logger.info(f'Invalidated cached rankings of {self.name}, now at cache generation {cache_generation}')
+        return cache_generation
+
+    def _diversify(self, generation: IndexGeneration, values: np.ndarray, indices: np.ndarray, min_distance: float, mmr_lambda: float | None):
+        """ Apply the diversity filters to the results of a single query
+
+        Args:
+            generation (IndexGeneration): The generation the row ids belong to
+            values (np.ndarray): Similarities of the results to the query, in descending order
+            indices (np.ndarray): Row ids of the results
+            min_distance (float): Minimum distance between results. Ranges from 0 to 1, 0 returning all results and 1 returning none.
+            mmr_lambda (float | None): If set, rerank with Maximal Marginal Relevance, 1 is pure relevance and 0 is pure diversity.
+
+        Returns:
+            values (np.ndarray): Similarities of the kept results, in their new order
+            indices (np.ndarray): Row ids of the kept results, in their new order
+        """
+        vectors = generation.get_vectors(indices)  # the normalized float32 vectors straight from our store, no torch round trip
+        if min_distance > 0:
+            keep = diversity.min_distance_filter(vectors, min_distance)
+            values, indices, vectors = values[keep], indices[keep], vectors[keep]
+        if mmr_lambda is not None:
+            order = diversity.mmr(vectors, values, mmr_lambda)
+            values, indices = values[order], indices[order]
+        return values, indices
+
+    def _ensure_index(self):
+        """ Make sure there is a generation to query, a cold index is warmed in the background and the query gets IndexWarming instead of waiting on the build """
+        if self.generation is not None:
+            self._check_snapshot()
+            return
+        if DEBUG:  # nothing is warmed at startup in DEBUG, so build on first use rather than making the developer retry
+            logger.info(f'Index not generated for {self.name}, generating..')
+            self.wait_ready()
+        else:
+            self.warm_async()
+
+        if self.generation is None:
+            raise IndexWarming(f'The {self.name} index is {self.state}, try again shortly')
+
+    def row_ids(self, pks: list) -> np.ndarray:
+        """ Row ids of the given pks in the current generation, -1 for pks that are not indexed """
+        generation = self.generation
+        return generation.row_ids(pks) if generation is not None else np.full(len(pks), -1, dtype=np.int64)
+
+    def get_vectors(self, pks: list) -> tuple[np.ndarray, np.ndarray]:
+        """ Embeddings of the given pks read straight from the index, pks that are not indexed, or all of them while the index warms, are fetched from the database in a single query
+
+        Args:
+            pks (list): Primary keys, of the type of the pk field, ie UUIDs for content
+
+        Returns:
+            vectors (np.ndarray): (len(pks), d) float32 embeddings, row i belongs to pks[i], zeros for pks that do not exist
+            found (np.ndarray): Whether each pk exists
+        """
+        vectors = np.zeros((len(pks), self.d), dtype=np.float32)
+        generation = self.generation  # row ids only make sense against the generation they were read from
+        ids = generation.row_ids(pks) if generation is not None else np.full(len(pks), -1, dtype=np.int64)
+        found = ids != -1
+        if found.any():
+            vectors[found] = generation.get_vectors(ids[found])
+        if not found.all():
+            missing = {pk: i for i, pk in enumerate(pks) if not found[i]}
+            for pk, vector in self.model.objects.filter(pk__in=list(missing)).values_list('pk', 'embedding_all_mpnet_base_v2'):
+                if vector is not None:
+                    vectors[missing[pk]] = vector
+                    found[missing[pk]] = True
+        return vectors, found
+
+    def get_vector(self, pk) -> np.ndarray | None:
+        """ Embedding of a single pk, see get_vectors, None if it does not exist """
+        vectors, found = self.get_vectors([pk])
+        return vectors[0] if found[0] else None
+
+    def _query_vectors(self, queries: list[str] | list[list[float]] | np.ndarray) -> np.ndarray:
+        """ Turn a list of strings or vectors, or a matrix of vectors, into a (n, d) float32 matrix of query vectors """
+        if isinstance(queries, list) and len(queries) == 0:
+            return np.empty((0, self.d), dtype=np.float32)
+        if isinstance(queries, list) and all(type(x) == str for x in queries):
+            query_vectors = embedding_model.encode(queries).astype(np.float32)  # embedded in a single batch
+        else:
+            try:
+                query_vectors = np.asarray(queries, dtype=np.float32)
+            except (TypeError, ValueError):
+                raise ValueError('Queries must be a list[str], list[list[float]], or np.ndarray')
+            if query_vectors.ndim != 2 or query_vectors.shape[1] != self.d:
+                raise ValueError(f'Query vectors must be of shape (n, {self.d})')
+
+        assert np.isfinite(query_vectors).all(), "Query vector contains NaN or Inf"
+        return np.ascontiguousarray(query_vectors)
+
+    def _rank(self, query_vectors: np.ndarray, k: int, min_distance: float, mmr_lambda: float | None, use_cached: bool, truncate_results: bool, filters: dict | None = None) -> list[list[tuple]]:
+        """ Rank the index against each query vector with a single cache round trip and a single faiss search for the cache misses
+
+        Concurrent calls with the same query vectors and params wait on the first one rather than all missing the cache and searching, unless use_cached is False.
+
+        Returns:
+            list[list[tuple]]: Per query vector, a list of pk and similarity pairs in descending order
+        """
+        if not use_cached:
+            return self._rank_uncoalesced(query_vectors, k, min_distance, mmr_lambda, use_cached, truncate_results, filters)
+        key = vector_cache_key(self._cache_namespace, query_vectors, k, min_distance, mmr_lambda, sorted((filters or {}).items()), truncate_results)
+        rankings = self._in_flight.do(key, self._rank_uncoalesced, query_vectors, k, min_distance, mmr_lambda, use_cached, truncate_results, filters)
+        return [list(x) for x in rankings]  # the lists are shared with every waiter
+
+    def _rank_uncoalesced(self, query_vectors: np.ndarray, k: int, min_distance: float, mmr_lambda: float | None, use_cached: bool, truncate_results: bool, filters: dict | None = None) -> list[list[tuple]]:
+        generation = self.generation  # a rebuild may swap in a new generation at any moment, row ids only make sense against the one we searched
+
+        if min_distance > 0 or mmr_lambda is not None:  # if we want to filter or rerank results then we must get extra results initially to satisfy k
+            n = max(k, min(10*k, DIVERSITY_MAX_CANDIDATES))  # deep searches, ie the later pages behind a cursor, get no more than k
+        else:
+            n = k
+
+        # generate a unique deterministic string to cache the results of each query vector
+        cached_results = {}
+        if use_cached: # It's important to include all the params that affect the results, otherwise we could cache incorrect results
+            filter_items = sorted((filters or {}).items())
+            namespace = self._cache_namespace + generation.fingerprint.encode('utf-8') + self.cache_generation().to_bytes(8, 'big')
+            cache_keys = [vector_cache_key(namespace, x, n, min_distance, mmr_lambda, filter_items) for x in query_vectors]
+            cached_results = cache.get_many(cache_keys)
 
-    def query(self, query: str | list[float] | np.ndarray, k: int = 1, min_distance: float = 0.0, use_cached=True, truncate_results=True):
+        rankings = [None]*len(query_vectors)
+        to_search = []
+        for i in range(len(query_vectors)):
+            if use_cached and cached_results.get(cache_keys[i]):  # if we got results unpack them
+                cleaned_values, cleaned_pks = cached_results[cache_keys[i]]
+                # drop anything that has been removed from the index since it was cached
+                alive = generation.row_ids(cleaned_pks) != -1
+                rankings[i] = [(pk, value) for pk, value, is_alive in zip(cleaned_pks, cleaned_values, alive) if is_alive]
+            else:
+                to_search.append(i)
+
+        # if not in cache, run the search for all the misses at once and cache the results
+        to_cache = {}
+        if to_search:
+            for i, (values, indices) in zip(to_search, generation.search(query_vectors[to_search], n, filters, self.rerank)):
+                # -1 is the value returned when there is no match because k is out of index bounds
+                found = indices != -1
+                values, indices = values[found], indices[found]
+
+                # figure out if we need to run min_distance or mmr or not, do so if necessary
+                if min_distance > 0 or mmr_lambda is not None:
+                    values, indices = self._diversify(generation, values, indices, min_distance, mmr_lambda)
+
+                # map row ids to pks now, row ids are not stable across compactions and rebuilds so they must never be cached
+                cleaned_values, cleaned_pks = values.tolist(), [generation.pks[x] for x in indices]
+                rankings[i] = list(zip(cleaned_pks, cleaned_values))
+                if use_cached:
+                    to_cache[cache_keys[i]] = (cleaned_values, cleaned_pks)
+        if to_cache:
+            cache.set_many(to_cache, timeout=self.cache_timeout)
+
+        # truncate to k results since we might have expanded them if we used min_distance
+        if truncate_results:
+            rankings = [x[:k] for x in rankings]
+        return rankings
+
+    def query(self, query: str | list[float] | np.ndarray, k: int = 1, min_distance: float = 0.0, use_cached=True, truncate_results=True, mmr_lambda: float | None = None, filters: dict | None = None):
         """ Find closest k matches for a given query or vector using semantic embedding_model
 
         Args:
-            query (str | list[float] | np.ndarray): The string, list of strings, or embed vector to find closest matches for
+            query (str | list[float] | np.ndarray): The string or embed vector to find closest matches for, use query_batch for multiple queries
             k (int, optional): Number of results to return. Defaults to 1.
             min_distance (float, optional): Minimum distance between matches. Ranges from 0 to 1, 0 returning all results and 1 returning none. Defaults to 0.
             use_cached (bool, optional): Whether to use the cached vectors or not. Defaults to True.
             truncate_results (bool, optional): Whether to truncate the results to the top k. Defaults to True.
+            mmr_lambda (float, optional): If set, rerank the results with Maximal Marginal Relevance. Ranges from 0 to 1, 1 is pure relevance and 0 is pure diversity. Defaults to None.
+            filters (dict, optional): Django style lookups on the attributes of the index, ie {'type__in': ['article'], 'content_read_seconds__range': (60, 600)}, applied inside the search so k filtered results come back. Defaults to None.
 
         Returns:
             results: (QuerySet): List of tuples, object from self.queryset and its similarity to the query, in descending order or a queryset.
             rankings: (list): List of tuples, pk and similarity to the query pairs, in descending order.
             query_vector (np.ndarray): embedding of the submitted query if a query is a str instead of an np.ndarray.
         """
-
-        if not hasattr(self, 'index'):
-            logger.info(f'Index not generated for {self.queryset.model.__name__}, generating..')
-            self._generate_index()
-
-        # For redundancy, just to make sure the index truly did get generated
-        assert self.index is not None, 'Index not generated'
+        self._ensure_index()
 
         if type(query) == str:
-            query_vector = embedding_model.encode([query]).astype(np.float32)
-        # TODO: make this method able to handle multiple queries or make a new method for backwards compat
-        # elif type(query) == list and all(type(x) == str for x in query):
-        #     query_vector = embedding_model.encode(query).astype(np.float32)
-        elif type(query) == np.ndarray:
-            query_vector = np.array([query]).astype(np.float32)
-        elif type(query) == list and all(type(x) == float for x in query):
-            if len(query) != self.d:
-                raise ValueError(f'Query vector must be of length {self.d}')
-            query_vector = np.array([query]).astype(np.float32)
+            query_vector = self._query_vectors([query])
+        elif type(query) == np.ndarray or (type(query) == list and all(type(x) == float for x in query)):
+            query_vector = self._query_vectors(np.asarray(query, dtype=np.float32).reshape(1, -1))
         else:
             raise ValueError('Query must be a str, list[float], or np.ndarray')
 
-        assert np.isfinite(query_vector).all(), "Query vector contains NaN or Inf"
+        rankings = self._rank(query_vector, k, min_distance, mmr_lambda, use_cached, truncate_results, filters)[0]
+
+        # the queryset could be sliced to ensure that we are using a new queryset to filter the results
+        results: QuerySet = self.queryset.model.objects.filter(pk__in=[pk for pk, value in rankings])
+        return results, rankings, query_vector
+
+    def query_batch(self, queries: list[str] | list[list[float]] | np.ndarray, k: int = 1, min_distance: float = 0.0, use_cached=True, truncate_results=True, hydrate=True, mmr_lambda: float | None = None, filters: dict | None = None):
+        """ Find closest k matches for each of many queries or vectors with a single faiss search
+
+        Args:
+            queries (list[str] | list[list[float]] | np.ndarray): The strings, or embed vectors as a list or a (n, d) matrix, to find closest matches for
+            k (int, optional): Number of results to return per query. Defaults to 1.
+            min_distance (float, optional): Minimum distance between matches. Ranges from 0 to 1, 0 returning all results and 1 returning none. Defaults to 0.
+            use_cached (bool, optional): Whether to use the cached vectors or not. Defaults to True.
+            truncate_results (bool, optional): Whether to truncate the results to the top k. Defaults to True.
+            hydrate (bool, optional): Whether to fetch the matched objects from the db, in one round trip for the whole batch. Defaults to True.
+            mmr_lambda (float, optional): If set, rerank the results with Maximal Marginal Relevance. Ranges from 0 to 1, 1 is pure relevance and 0 is pure diversity. Defaults to None.
+            filters (dict, optional): Django style lookups on the attributes of the index, ie {'type__in': ['article'], 'content_read_seconds__range': (60, 600)}, applied inside the search so k filtered results come back. Defaults to None.
+
+        Returns:
+            results: (list[list[Model]] | None): Per query, the matched objects in descending order of similarity. None if hydrate is False.
+            rankings: (list[list[tuple]]): Per query, a list of pk and similarity to the query pairs, in descending order.
+            query_vectors (np.ndarray): (n, d) embeddings of the submitted queries.
+        """
+        self._ensure_index()
+
+        query_vectors = self._query_vectors(queries)
+        rankings = self._rank(query_vectors, k, min_distance, mmr_lambda, use_cached, truncate_results, filters)
+
+        results = None
+        if hydrate:
+            objects = self.queryset.model.objects.in_bulk({pk for ranking in rankings for pk, value in ranking})
+            results = [[objects[pk] for pk, value in ranking if pk in objects] for ranking in rankings]
+        return results, rankings, query_vectors
+
+
+# fields of content that the content indexes can filter on inside the search
+CONTENT_ATTRIBUTES = ('provider', 'type', 'content_read_seconds', 'deleted')
+
 
-        if min_distance > 0:  # if we want to filter results then we must get extra results initially to satisfy k
-            p = 10
+@dataclasses.dataclass
+class IndexSpec():
+    """ Declaration of a VectorIndex, init_indexes registers one index per enabled spec, see VectorIndex for what most fields mean """
+    name: str
+    queryset: Callable[[], QuerySet]  # called once the app registry is ready
+    factory: str = 'Flat'
+    search_params: dict = dataclasses.field(default_factory=dict)
+    rerank: int = 0
+    attributes: tuple[str, ...] = ()
+    hot: bool = False  # small and behind most endpoints, readiness waits for these
+    cache_timeout: int = 60*60*24*2  # how long query results are cached, in seconds
+    memory_budget: int | None = None  # bytes the index may hold in memory before it is reported over budget
+    enabled: bool = True
+
+    def build(self, generate_index=False) -> VectorIndex:
+        """ A VectorIndex as this spec declares it, not loaded unless generate_index """
+        return VectorIndex(self.queryset(), generate_index, name=self.name, factory=self.factory, search_params=self.search_params, rerank=self.rerank,
+                           attributes=self.attributes, cache_timeout=self.cache_timeout, memory_budget=self.memory_budget)
+
+
+# every index in priority order, the order they are warmed in, skills are behind nearly every endpoint and are quick, the big content and unsplash indexes come last
+# fields can be overridden per deployment through the INDEX_OVERRIDES setting, ie to disable, resize or recompress an index
+INDEX_SPECS = [
+    IndexSpec('skill', lambda: Skill.objects.all(), hot=True),
+    IndexSpec('mindtools_group', lambda: MindtoolsSkillGroup.objects.all(), hot=True),
+    IndexSpec('mindtools_subgroup', lambda: MindtoolsSkillSubgroup.objects.all(), hot=True),
+    IndexSpec('topic', lambda: Topic.objects.all(), hot=True),
+    IndexSpec('job', lambda: Job.objects.all(), hot=True),
+    IndexSpec('vodafone', lambda: Content.objects.exclude(embedding_all_mpnet_base_v2__isnull=True).filter(provider='vodafone'), attributes=CONTENT_ATTRIBUTES),  # index only vodafone content for demo purposes
+    # index only content that has more than 200 likes - supposedly the  best 10% of content according to the numbers in our db
+    IndexSpec('content', lambda: Content.objects.exclude(embedding_all_mpnet_base_v2__isnull=True).filter(~Q(provider='medium') | (Q(provider='medium') & Q(popularity__medium__totalClapCount__gt=200))), factory='auto', attributes=CONTENT_ATTRIBUTES),
+    # index only the first 30000 unsplash photos, 'auto' so it is brute force over the memory-mapped vectors at that size and an IVF, whose lists are memory-mapped too, if the cap is lifted
+    # not HNSW, faiss reads its graph and storage into memory even with IO_FLAG_MMAP so every worker would hold a private copy
+    IndexSpec('unsplash', lambda: UnsplashPhoto.objects.exclude(embedding_all_mpnet_base_v2__isnull=True)[:30000], factory='auto'),
+]
+
+# the registry, name to index of every enabled spec in priority order, filled by init_indexes
+indexes: dict[str, VectorIndex] = {}
+specs: dict[str, IndexSpec] = {}
+warmup_thread: threading.Thread | None = None
+
+
+class IndexNotFound(APIException):
+    status_code = status.HTTP_404_NOT_FOUND
+    default_detail = 'No such index in this deployment'
+    default_code = 'index_not_found'
+
+
+def get_index(name: str) -> VectorIndex:
+    """ The registered index of the given name, raises IndexNotFound, a 404 for views, if it is not declared or disabled in this deployment """
+    try:
+        return indexes[name]
+    except KeyError:
+        raise IndexNotFound(f'No index {name} in this deployment, available: {list(indexes)}')
+
+
+def content_indexes() -> list[VectorIndex]:
+    """ The registered indexes of Content, the ones that filter on CONTENT_ATTRIBUTES """
+    return [x for name, x in indexes.items() if specs[name].attributes == CONTENT_ATTRIBUTES]
+
+
+def sync_content(content: Content, invalidate: bool = True) -> bool:
+    """ Bring the rows of a saved Content in the content indexes up to date, without a rebuild
+
+    It is upserted into every index whose QuerySet still selects it and removed from the others, ie the content index once it is deleted or the vodafone one if its provider changed.
+    Indexes that already hold its vector and attributes are left alone, so saves that only touch other fields cost no tombstone and no cache invalidation.
+
+    Args:
+        content (Content): The saved content
+        invalidate (bool, optional): Whether to invalidate the cached rankings of the indexes that changed, bulk updates pass False and invalidate once at the end. Defaults to True.
+
+    Returns:
+        bool: Whether any index changed
+    """
+    attributes = {x: getattr(content, x) for x in CONTENT_ATTRIBUTES}
+    changed = False
+    for vector_index in content_indexes():
+        if content.embedding_all_mpnet_base_v2 is not None and vector_index.queryset.filter(pk=content.pk).exists():
+            changed |= vector_index.upsert(content.pk, content.embedding_all_mpnet_base_v2, attributes, invalidate)
         else:
-            p = 1
+            changed |= vector_index.remove(content.pk, invalidate)
+    return changed
 
-        # generate a unique deterministic string to cache the results
-        if use_cached: # It's important to include all the params that affect the results, otherwise we could cache incorrect results
-            cache_key = generate_cache_key(query_vector.tolist(), str(self.queryset.query), k*p, min_distance, version=2)
-            cached_results = cache.get(cache_key)
-
-        if use_cached and cached_results:  # if we got results unpack them
-            cleaned_values, cleaned_indices = cached_results
-        else:  # if not in cache, run the search and cache the results
-            values, indices = self.index.search(query_vector, k*p)
-            # figure out if we need to run min_distance or not, do so if necessary, and get a list of results
-            if min_distance > 0:
-                # so for clarity, cleaned indices is a list of i values corresponding to our parent queryset, our queryset, where results_to_remove is a list of i values that got removed from indices, which can be confusing because there are two lists of indices, one being the parent of the other essentially
-                cleaned_indices, results_to_remove = self._min_distance(indices, min_distance)
-                # we need to keep values in the same order as cleaned_indices, so remove the values corresponding to the indices we removed
-                cleaned_values = [value for i, value in enumerate(values.tolist()[0]) if i not in results_to_remove]
-            else:
-                cleaned_indices = indices.tolist()[0]  # 0 because query_vector is a list of 1 element
-                cleaned_values = values.tolist()[0]
-            # store the results as a tuple of np.ndarrays, with the row index and its value (ranking) to be able to depickle and order easily later
-            if use_cached:
-                cache.set(cache_key, (cleaned_values, cleaned_indices), timeout=60*60*24*2)  # 2 day timeout
 
-        # truncate to k results since we might have expanded them if we used min_distance
-        if truncate_results:
-            cleaned_indices = cleaned_indices[:k]
-            cleaned_values = cleaned_values[:k]
+def _warm_quietly(vector_index: VectorIndex):
+    """ Thread target for warming, failures are already logged and kept in the state of the index, the next query on it retries """
+    try:
+        vector_index.warm()
+    except Exception:
+        pass
+    finally:
+        connection.close()  # this thread opened its own db connection, dont leak it
 
-        # the queryset could be sliced to ensure that we are using a new queryset to filter the results
-        results: QuerySet = self.queryset.model.objects.filter(pk__in=[self.pks[x] for x in cleaned_indices if x != -1]) # -1 is the value returned when there is no match because k is out of index bounds
-        rankings = [(self.pks[indice], value) for indice, value in zip(cleaned_indices, cleaned_values)]
-        return results, rankings, query_vector
+
+def warmup(indexes_to_warm: list[VectorIndex]):
+    """ Warm the given indexes one by one in priority order, loading from snapshot when fresh so warm boots skip postgres entirely """
+    start = time.perf_counter()
+    for vector_index in indexes_to_warm:
+        _warm_quietly(vector_index)
+    logger.info(f'Warmed {sum(x.state == "ready" for x in indexes_to_warm)}/{len(indexes_to_warm)} indexes in {time.perf_counter()-start:.3f}s')
 
 
-# decleare VectorIndexes as global so we can access them throughout the app
-topic_index: VectorIndex
-skills_index: VectorIndex
-content_index: VectorIndex
-unsplash_photo_index: VectorIndex
-vodafone_index: VectorIndex
-jobs_index: VectorIndex
-mindtools_skillgroup_index: VectorIndex
-mindtools_skillsubgroup_index: VectorIndex
+def readiness() -> tuple[bool, dict[str, dict]]:
+    """ Whether every hot index is ready to serve, and the status of each index """
+    statuses = {name: dict(x.status(), hot=specs[name].hot) for name, x in indexes.items()}
+    return all(x['state'] == 'ready' for x in statuses.values() if x['hot']), statuses
 
-def init_indexes(multithreaded=True):
+
+def init_indexes(warm=True):
     """ 
-    Initialize the VectorIndexes for each model in parrallel
+    Register a VectorIndex for each enabled spec and warm them in priority order in a background thread, so startup and requests never wait on a build
     Each index is initiated by a QuerySet, some have filters, each QuerySet's model is a child of StringEmbedding
     """
+    global warmup_thread
     logger.info('Initializing indexes..')
-    start = time.perf_counter()
 
-    # we are updating the declared global indexes
-    global content_index
-    global topic_index
-    global jobs_index
-    global unsplash_photo_index
-    global vodafone_index
-    global skills_index
-    global mindtools_skillgroup_index
-    global mindtools_skillsubgroup_index
-
-    # Define the indexes but do not run the indexing yet
-    content_index = VectorIndex(Content.objects.exclude(embedding_all_mpnet_base_v2__isnull=True).filter(~Q(provider='medium') | (Q(provider='medium') & Q(popularity__medium__totalClapCount__gt=200))), not multithreaded)  # index only content that has more than 200 likes - supposedly the  best 10% of content according to the numbers in our db
-    topic_index = VectorIndex(Topic.objects.all(), not multithreaded)
-    jobs_index = VectorIndex(Job.objects.all(), not multithreaded)
-    unsplash_photo_index = VectorIndex(UnsplashPhoto.objects.exclude(embedding_all_mpnet_base_v2__isnull=True)[:30000], not multithreaded)  # index only the first 30000 unsplash photos
-    vodafone_index = VectorIndex(Content.objects.exclude(embedding_all_mpnet_base_v2__isnull=True).filter(provider='vodafone'), not multithreaded)  # index only vodafone content for demo purposes
-    skills_index = VectorIndex(Skill.objects.all(), False)
-    mindtools_skillgroup_index = VectorIndex(MindtoolsSkillGroup.objects.all(), False)
-    mindtools_skillsubgroup_index = VectorIndex(MindtoolsSkillSubgroup.objects.all(), False)
-
-    # Build lists so that we can initialize the indexes in parallel. Debug mode has a different list to make sure we only load what we need to debug, as this takes quite some time.
-    if not DEBUG:
-        indexes_to_build = [content_index, topic_index, jobs_index, unsplash_photo_index, vodafone_index, skills_index, mindtools_skillgroup_index, mindtools_skillsubgroup_index]
-    else:
-        indexes_to_build = []
-
-    # build the indexes in parallel
-    logger.info(f'{len(indexes_to_build)} indexes specified to be built at startup.')
-    if len(indexes_to_build) == 0:
-        return
-    elif multithreaded:
-        with ThreadPool(processes=3) as pool:
-            pool.map(lambda x: x._generate_index(), indexes_to_build)
-    logger.info(f'Indexes initialized in {time.perf_counter()-start:.3f}s!')
+    indexes.clear()
+    specs.clear()
+    for spec in INDEX_SPECS:
+        spec = dataclasses.replace(spec, **INDEX_OVERRIDES.get(spec.name, {}))
+        if not spec.enabled:
+            logger.info(f'Index {spec.name} is disabled in this deployment')
+            continue
+        # Define the index but do not run the indexing yet
+        specs[spec.name] = spec
+        indexes[spec.name] = spec.build()
+
+    # Debug mode warms nothing to keep startup quick, indexes are then built on first use
+    if warm and not DEBUG:
+        warmup_thread = threading.Thread(target=warmup, args=(list(indexes.values()),), name='index_warmup', daemon=True)
+        warmup_thread.start()
 
 
 def ready():
     """ This function is called when the app is ready to be used. """
-    init_indexes(multithreaded=True)
+    init_indexes()
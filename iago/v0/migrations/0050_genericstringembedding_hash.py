@@ -0,0 +1,60 @@
+# Generated by Django 4.0.6 on 2022-08-22 12:00
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+# the embedding model every row cached so far was made with, frozen here like the rest of this migration
+MODEL_NAME = 'all-mpnet-base-v2'
+
+
+def normalize(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFC', text).lower().split())
+
+
+def text_hash(model_name: str, text: str) -> str:
+    return hashlib.sha256(f'{model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+
+def fill_hashes(apps, schema_editor):
+    """ Hash every cached row, deleting rows whose normalized text is already cached by an older row """
+    GenericStringEmbedding = apps.get_model('v0', 'GenericStringEmbedding')
+    seen = set()
+    duplicates = []
+    batch = []
+    for row in GenericStringEmbedding.objects.only('id', 'name').order_by('id').iterator(chunk_size=2000):
+        row.name = normalize(row.name)
+        row.hash = text_hash(MODEL_NAME, row.name)
+        if row.hash in seen:
+            duplicates.append(row.id)
+            continue
+        seen.add(row.hash)
+        batch.append(row)
+        if len(batch) >= 2000:
+            GenericStringEmbedding.objects.bulk_update(batch, ['name', 'hash'])
+            batch = []
+    GenericStringEmbedding.objects.bulk_update(batch, ['name', 'hash'])
+    for i in range(0, len(duplicates), 2000):
+        GenericStringEmbedding.objects.filter(id__in=duplicates[i:i+2000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v0', '0049_remove_content_mindtools_skill_group_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genericstringembedding',
+            name='hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='genericstringembedding',
+            name='hash',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.0.6 on 2022-08-24 12:00
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import v0.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v0', '0050_genericstringembedding_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='genericstringembedding',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AlterField(
+            model_name='mindtoolsskillgroup',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AlterField(
+            model_name='mindtoolsskillsubgroup',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AlterField(
+            model_name='skill',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='embedding_all_mpnet_base_v2',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), null=True, size=768),
+        ),
+        migrations.AddField(
+            model_name='content',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(blank=True, dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='genericstringembedding',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='mindtoolsskillgroup',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='mindtoolsskillsubgroup',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='skill',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(dimensions=768, null=True),
+        ),
+        migrations.AddField(
+            model_name='unsplashphoto',
+            name='embedding_all_mpnet_base_v2_f4',
+            field=v0.fields.EmbeddingField(blank=True, dimensions=768, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.6 on 2022-08-24 12:00
+
+from django.db import migrations
+
+MODELS = ['content', 'genericstringembedding', 'job', 'mindtoolsskillgroup', 'mindtoolsskillsubgroup', 'skill', 'topic', 'unsplashphoto']
+CHUNK_SIZE = 2000
+
+
+def copy_embeddings(apps, source: str, target: str):
+    """ Copy every embedding from the source field to the target field, chunk by chunk, rows already copied are skipped so a failed run can just be rerun """
+    for model_name in MODELS:
+        model = apps.get_model('v0', model_name)
+        rows = model.objects.filter(**{f'{source}__isnull': False, f'{target}__isnull': True}).values_list('pk', source)
+        batch = []
+        for pk, vector in rows.iterator(chunk_size=CHUNK_SIZE):
+            batch.append(model(pk=pk, **{target: list(vector)}))  # the EmbeddingField packs lists into float32 bytes, the ArrayField takes them as is
+            if len(batch) == CHUNK_SIZE:
+                model.objects.bulk_update(batch, [target])
+                batch = []
+        model.objects.bulk_update(batch, [target])
+
+
+def to_f4(apps, schema_editor):
+    copy_embeddings(apps, 'embedding_all_mpnet_base_v2', 'embedding_all_mpnet_base_v2_f4')
+
+
+def to_array(apps, schema_editor):
+    copy_embeddings(apps, 'embedding_all_mpnet_base_v2_f4', 'embedding_all_mpnet_base_v2')
+
+
+class Migration(migrations.Migration):
+    atomic = False  # each chunk commits on its own, the content and unsplash tables are too big for one transaction
+
+    dependencies = [
+        ('v0', '0051_embedding_f4'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_f4, to_array),
+    ]
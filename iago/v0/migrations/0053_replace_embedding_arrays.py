@@ -0,0 +1,116 @@
+# Generated by Django 4.0.6 on 2022-08-24 12:00
+
+from django.db import migrations
+import v0.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('v0', '0052_convert_embeddings_to_f4'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='content',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='content',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='genericstringembedding',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='genericstringembedding',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='job',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='job',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='mindtoolsskillgroup',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='mindtoolsskillgroup',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='mindtoolsskillsubgroup',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='mindtoolsskillsubgroup',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='skill',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='skill',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='topic',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='topic',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RemoveField(
+            model_name='unsplashphoto',
+            name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.RenameField(
+            model_name='unsplashphoto',
+            old_name='embedding_all_mpnet_base_v2_f4',
+            new_name='embedding_all_mpnet_base_v2',
+        ),
+        migrations.AlterField(
+            model_name='genericstringembedding',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+        migrations.AlterField(
+            model_name='mindtoolsskillgroup',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+        migrations.AlterField(
+            model_name='mindtoolsskillsubgroup',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+        migrations.AlterField(
+            model_name='skill',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='embedding_all_mpnet_base_v2',
+            field=v0.fields.EmbeddingField(dimensions=768),
+        ),
+    ]
@@ -1,11 +1,14 @@
+import hashlib
 import logging
+import unicodedata
 import uuid
 
 import numpy as np
-from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from iago.settings import LOGGING_LEVEL_MODULE, MODEL_VECTOR_SIZE
 
+from v0.fields import EmbeddingField
+
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGING_LEVEL_MODULE)
 
@@ -15,12 +18,12 @@ logger.setLevel(LOGGING_LEVEL_MODULE)
 class StringEmbedding(models.Model):
     """ Abstract class for string-embedding pairs """
     name = models.CharField(max_length=255, primary_key=True, editable=False)
-    embedding_all_mpnet_base_v2 = ArrayField(models.FloatField(), size=MODEL_VECTOR_SIZE)
+    embedding_all_mpnet_base_v2 = EmbeddingField(dimensions=MODEL_VECTOR_SIZE)
 
     def create(self, name: str, embedding: list | np.ndarray | None = None):
         """ Set name and generate embedding """
         self.name = name
-        self.embedding_all_mpnet_base_v2 = list(embedding)
+        self.embedding_all_mpnet_base_v2 = np.asarray(embedding, dtype=np.float32)
         return self
 
     def __str__(self):
@@ -31,9 +34,26 @@ class StringEmbedding(models.Model):
 
 
 class GenericStringEmbedding(StringEmbedding):
-    """ Uncategorized generic string and embedding pair - used primarily as a persistent cache of embeddings """
+    """ Uncategorized generic string and embedding pair - used primarily as a persistent cache of embeddings, looked up by text_hash so texts of any length can be cached """
     id = models.BigAutoField(primary_key=True)
     name = models.TextField(editable=False)
+    hash = models.CharField(max_length=64, unique=True, editable=False)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """ The form a text is cached and embedded in, case and runs of whitespace dont change what we want out of the embedding """
+        return ' '.join(unicodedata.normalize('NFC', text).lower().split())
+
+    @staticmethod
+    def text_hash(model_name: str, text: str) -> str:
+        """ Cache key of the embedding of an already normalized text by the given model, hex sha256 """
+        return hashlib.sha256(f'{model_name}\0{text}'.encode('utf-8')).hexdigest()
+
+    def create(self, name: str, embedding: list | np.ndarray | None = None, model_name: str = 'all-mpnet-base-v2'):
+        """ Set the normalized name, its hash and the embedding """
+        super().create(self.normalize(name), embedding)
+        self.hash = self.text_hash(model_name, self.name)
+        return self
 
 
 class Topic(StringEmbedding):
@@ -156,7 +176,7 @@ class UnsplashPhoto(models.Model):
     ai_primary_landmark_confidence = models.CharField(max_length=255, blank=True, null=True)
     blur_hash = models.CharField(max_length=255, blank=True, null=True)
     # new fields
-    embedding_all_mpnet_base_v2 = ArrayField(models.FloatField(), size=MODEL_VECTOR_SIZE, null=True, blank=True)
+    embedding_all_mpnet_base_v2 = EmbeddingField(dimensions=MODEL_VECTOR_SIZE, null=True, blank=True)
 
     def __str__(self):
         return str(self.photo_url)
@@ -213,7 +233,7 @@ class Content(models.Model):
     file = models.FileField(upload_to='content/', blank=True, null=True)
 
     # embeddings
-    embedding_all_mpnet_base_v2 = ArrayField(models.FloatField(), size=MODEL_VECTOR_SIZE, blank=True, null=True) # TODO: make this non nullable
+    embedding_all_mpnet_base_v2 = EmbeddingField(dimensions=MODEL_VECTOR_SIZE, blank=True, null=True) # TODO: make this non nullable
 
     def __str__(self):
         return str(self.title)
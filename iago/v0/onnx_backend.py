@@ -0,0 +1,133 @@
+""" ONNX Runtime inference for sentence_transformers models, optionally int8 quantized, for CPU boxes where eager torch is slow """
+import contextlib
+import fcntl
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# sentences the parity check embeds with both backends, a mix of the short skill names and longer texts we embed
+PARITY_SENTENCES = [
+    'python', 'project management', 'emotional intelligence', 'software engineer', 'data scientist',
+    'How to give feedback that your team will actually act on',
+    'Five habits of leaders who build trust quickly in remote teams',
+    'An introduction to gradient boosting, decision trees and why ensembles of weak learners work so well in practice',
+    'Negotiation is less about winning and more about understanding what the other side needs, here is a framework for preparing for any negotiation.',
+    'Kubernetes, docker and the cloud native toolchain explained for people who have never deployed a service',
+]
+
+
+class _SentenceEmbedding(torch.nn.Module):
+    """ The full sentence_transformers pipeline, transformer, pooling and normalization, as one module over the tokenizer outputs so it exports as one graph """
+
+    def __init__(self, model: SentenceTransformer):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model({'input_ids': input_ids, 'attention_mask': attention_mask})['sentence_embedding']
+
+
+@contextlib.contextmanager
+def _exclusive(path: Path):
+    """ Exclusive lock on path across every process on the host, so one worker writes a graph while the others wait and then load it """
+    with open(path.with_suffix('.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+        yield
+
+
+def _temp_path(path: Path) -> Path:
+    """ A fresh temp file next to path, to write to and then atomically move into place """
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=f'{path.stem}.', dir=path.parent)
+    os.close(fd)
+    return Path(tmp)
+
+
+class OnnxEncoder():
+    """ Embeds strings with an ONNX export of a SentenceTransformer, exported and quantized once then reused from disk
+
+    The SentenceTransformer stays the source of truth, it is what is exported, it tokenizes the inputs and the parity check compares against it.
+    """
+
+    def __init__(self, model: SentenceTransformer, path: Path, quantize: bool = False, batch_size: int = 32):
+        """
+        Args:
+            model (SentenceTransformer): The loaded model to export, with max_seq_length already set
+            path (Path): Where the exported graph is kept, the quantized one goes next to it with an .int8 suffix
+            quantize (bool, optional): Whether to run the graph with dynamic int8 quantization of its weights. Defaults to False.
+            batch_size (int, optional): Strings per session run. Defaults to 32.
+        """
+        import onnxruntime  # only needed for this backend
+
+        self.model = model
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.path = self._export(path)
+        if quantize:
+            self.path = self._quantize(self.path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(self.path), options, providers=['CPUExecutionProvider'])
+
+    def _export(self, path: Path) -> Path:
+        """ Export the model to path unless it is already there """
+        if path.exists():
+            return path
+        with _exclusive(path):
+            if path.exists():  # another worker exported it while we waited
+                return path
+            start = time.perf_counter()
+            features = self.model.tokenize(['export'])
+            tmp = _temp_path(path)
+            try:
+                with torch.no_grad():
+                    torch.onnx.export(_SentenceEmbedding(self.model).eval(), (features['input_ids'], features['attention_mask']), str(tmp),
+                                      input_names=['input_ids', 'attention_mask'], output_names=['sentence_embedding'], opset_version=14,
+                                      dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}, 'sentence_embedding': {0: 'batch'}})
+                tmp.replace(path)  # atomic so a crashed export is never loaded
+            finally:
+                tmp.unlink(missing_ok=True)
+            logger.info(f'Exported {path.name} in {time.perf_counter()-start:.3f}s')
+        return path
+
+    def _quantize(self, path: Path) -> Path:
+        """ Dynamic int8 quantization of the weights of the graph at path, unless already done """
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized = path.with_suffix('.int8.onnx')
+        if quantized.exists():
+            return quantized
+        with _exclusive(quantized):
+            if quantized.exists():
+                return quantized
+            start = time.perf_counter()
+            tmp = _temp_path(quantized)
+            try:
+                quantize_dynamic(str(path), str(tmp), weight_type=QuantType.QInt8)
+                tmp.replace(quantized)
+            finally:
+                tmp.unlink(missing_ok=True)
+            logger.info(f'Quantized {quantized.name} in {time.perf_counter()-start:.3f}s')
+        return quantized
+
+    def encode(self, strings: list[str], batch_size: int | None = None) -> np.ndarray:
+        """ Embed strings like SentenceTransformer.encode, float32 with one row per string, batch_size defaults to the one of the encoder """
+        batch_size = batch_size or self.batch_size
+        embeds = []
+        for i in range(0, len(strings), batch_size):
+            features = self.model.tokenize(strings[i:i+batch_size])
+            embeds.append(self.session.run(None, {'input_ids': features['input_ids'].numpy(), 'attention_mask': features['attention_mask'].numpy()})[0])
+        return np.concatenate(embeds) if embeds else np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    def parity(self, strings: list[str] = PARITY_SENTENCES) -> np.ndarray:
+        """ Cosine similarity of the embedding of each string by this backend to the one by torch """
+        expected = self.model.encode(strings, convert_to_numpy=True)
+        actual = self.encode(strings)
+        return np.sum(expected*actual, axis=1)/(np.linalg.norm(expected, axis=1)*np.linalg.norm(actual, axis=1))
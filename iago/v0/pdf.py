@@ -46,23 +46,30 @@ def ingestContentPDF(content: Content):
 
     # ai stuff
     # embed
-    content.embedding_all_mpnet_base_v2 = list(ai.embedding_model.encode([content.content], use_cache=False)[0])
+    content.embedding_all_mpnet_base_v2 = list(ai.embedding_model.encode_documents([content.content])[0])  # the whole document, not just its first max_seq_length tokens
 
     # summarize
     # reduce to max tokens
     trunc_text, num_tokens = truncateTextNTokens(content.content)
     content.summary[ai.SUMMARIZER_CONFIG['MODEL_NAME']] = ai.summarizer(trunc_text, min_length=ai.SUMMARIZER_CONFIG['MIN_LENGTH'], no_repeat_ngram_size=ai.SUMMARIZER_CONFIG['NO_REPEAT_NGRAM_SIZE'])[0]['summary_text']
 
-    # thumbnail
-    img = index.unsplash_photo_index.query(content.embedding_all_mpnet_base_v2, k=1, use_cached=False)[0][0]
-    content.thumbnail_alternative = img
+    # thumbnail, we are not serving a request so wait for the indexes to warm rather than get IndexWarming, either may be disabled in this deployment
+    unsplash_index = index.indexes.get('unsplash')
+    if unsplash_index is not None and unsplash_index.wait_ready():
+        img = unsplash_index.query(content.embedding_all_mpnet_base_v2, k=1, use_cached=False)[0][0]
+        content.thumbnail_alternative = img
 
     # skills
-    skills, rankings, query_vector = index.skills_index.query(content.embedding_all_mpnet_base_v2, k=5, min_distance=.21)
-    content.skills.set(skills)
+    skill_index = index.indexes.get('skill')
+    if skill_index is not None and skill_index.wait_ready():
+        skills, rankings, query_vector = skill_index.query(content.embedding_all_mpnet_base_v2, k=5, min_distance=.21)
+        content.skills.set(skills)
 
-    # tags are just the skills, leftover from the old medium stuff
-    content.tags = list(skills.values_list('name', flat=True))
+        # tags are just the skills, leftover from the old medium stuff
+        content.tags = list(skills.values_list('name', flat=True))
 
     content.save()
+
+    # make the new content searchable right away
+    index.sync_content(content)
     return content
@@ -9,6 +9,7 @@ k = {
     "properties": {
         "k": {
             "type": "integer",
+            "maximum": 100,
             "inclusiveMinimum": 0,
             "description": "The number of results to return per page."
         }
@@ -25,6 +26,7 @@ query_k = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "inclusiveMinimum": 0,
             "description": "The number of results to return per page."
         }
@@ -41,6 +43,7 @@ query_k_temperature = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "inclusiveMinimum": 0,
             "description": "The number of results to return per page."
         },
@@ -62,9 +65,14 @@ query_k_temperature_fields = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "inclusiveMinimum": 0,
             "description": "The number of results to return per page."
         },
+        "cursor": {
+            "type": "string",
+            "description": "The next_cursor returned with the previous page, to get the page after it without searching again. Takes precedence over page"
+        },
         "temperature": {
             "type": "integer",
             "inclusiveMinimum": 0,
@@ -92,6 +100,7 @@ model_field_search = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "exclusiveMinimum": 0,
             "description": "The number of results to return per page."
         },
@@ -122,6 +131,9 @@ texts = {
             "items": {
                 "type": "string"
             }
+        },
+        "document": {
+            "type": "boolean"
         }
     },
     "required": ["texts"],
@@ -156,6 +168,7 @@ skills_adjacent = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "description": "The number of adjacent skills to return per skill",
             "exclusiveMinimum": 0
         },
@@ -216,6 +229,7 @@ content_via_search = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "exclusiveMinimum": 0,
             "description": "The number of results to return per page."
         },
@@ -290,6 +304,7 @@ content_via_adjacent_skills = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "exclusiveMinimum": 0,
             "description": "The number of content pieces to return",
         },
@@ -336,6 +351,7 @@ content_via_recommendation = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "exclusiveMinimum": 0,
             "description": "The number of recommendations to return",
         },
@@ -344,6 +360,10 @@ content_via_recommendation = {
             "description": "The page to return. Each page has k elements. Defaults to 0",
             "inclusiveMinimum": 0
         },
+        "cursor": {
+            "type": "string",
+            "description": "The next_cursor returned with the previous page, to get the page after it without searching again. Takes precedence over page"
+        },
         "type": {
             "type": "array",
             "description": "The types of content to allow in result",
@@ -387,6 +407,12 @@ content_via_recommendation = {
             "inclusiveMinimum": 0,
             "inclusiveMaximum": 100
         },
+        "mmr_lambda": {
+            "type": "number",
+            "description": "If provided, rerank with Maximal Marginal Relevance. 1 is pure relevance and 0 is pure diversity",
+            "minimum": 0,
+            "maximum": 1
+        },
         "fields": {
             "type": "array",
             "description": "The fields to return",
@@ -444,6 +470,7 @@ content_via_title = {
         },
         "k": {
             "type": "integer",
+            "maximum": 100,
             "exclusiveMinimum": 0,
             "description": "The number of content pieces to return",
         },
@@ -86,8 +86,9 @@ class fileUploadSerializer(serializers.Serializer):
 class ContentRecommendationBySkillSerializer(serializers.Serializer):
     skills = serializers.ListField(child=serializers.CharField())
     fields = serializers.ListField(child=serializers.CharField(), validators=[FieldsInModel(Content)], default=['pk'])
-    k = serializers.IntegerField(validators=[CompareValues(Operator.GREATER_THAN, 0)], default=10)
+    k = serializers.IntegerField(validators=[CompareValues(Operator.GREATER_THAN, 0), CompareValues(Operator.LESS_THAN_OR_EQUAL_TO, 100)], default=10)
     page = serializers.IntegerField(validators=[CompareValues(Operator.GREATER_THAN_OR_EQUAL_TO, 0)], default=0)
+    cursor = serializers.CharField(required=False)  # next_cursor of the previous page, takes precedence over page
     provider = serializers.ListField(child=serializers.CharField(), validators=[ItemsInSet(Content.providers.names)], required=False)
     content_type = serializers.ListField(child=serializers.CharField(), validators=[ItemsInSet(Content.content_types.names)], required=False)
     individual_skill_recommendations = serializers.BooleanField(default=True)
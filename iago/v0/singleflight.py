@@ -0,0 +1,59 @@
+""" coalescing of identical concurrent calls, so a burst of the same request only does the work once """
+import threading
+from collections.abc import Callable, Hashable
+
+
+class _Call():
+    """ A computation in flight and, once done is set, its result or the exception it raised """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight():
+    """ Run at most one call per key at a time, threads that ask for a key already in flight wait for that call and share its result
+
+    Nothing is kept once a call returns, so this only coalesces calls that overlap, caching what they return is up to the caller.
+    Shared results must be treated as read-only, every waiter gets the very same object.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self.coalesced = 0  # calls served by waiting on another, for monitoring
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """ Call fn(*args, **kwargs), unless a call for key is already in flight, in which case wait for it and return its result or raise its exception
+
+        Args:
+            key (Hashable): Identifies the call, calls with equal keys must be interchangeable
+            fn (Callable): The computation
+
+        Returns:
+            The result of fn, possibly computed by another thread
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -10,6 +10,7 @@ logger.setLevel(LOGGING_LEVEL_MODULE)
 
 urlpatterns = [
     path('cache/clear', views.cache_clear.as_view()),
+    path('cache/stats', views.cache_stats.as_view()),
     path('content/adjacent_to_skills', views.content_via_adjacent_skills.as_view()),
     path('content/recommend', views.content_via_recommendation.as_view()),
     path('content/by_skills/<str:skill_group>', views.content_via_skills.as_view()),
@@ -17,8 +18,10 @@ urlpatterns = [
     path('content/update', views.content_update.as_view()),
     path('content/search_title', views.content_via_title.as_view()),
     path('content/upload', views.content_file_upload.as_view()),
+    path('embedding/stats', views.embedding_stats.as_view()),
     path('index/<str:index_choice>/query', views.index_query.as_view()),
     path('index/<str:index_choice>/rebuild', views.index_rebuild.as_view()),
+    path('index/<str:index_choice>/rebuild/<str:job_id>', views.index_rebuild_status.as_view()),
     path('objects/<str:model_choice>/all', views.stringEmbeddingListAll.as_view()),
     path('objects/<str:model_choice>/search', views.model_field_search.as_view()),
     path('objects/<str:model_choice>/<str:name>', views.stringEmbeddingCRUD.as_view()),
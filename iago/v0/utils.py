@@ -6,19 +6,28 @@ import logging
 import threading
 import time
 import unicodedata
-from collections.abc import Collection
-from uuid import UUID
+from collections.abc import Callable, Collection
+from uuid import UUID, uuid4
 
+import numpy as np
 from django.contrib.postgres.search import TrigramSimilarity
 from django.core.cache import cache
 from django.db import models
 from iago.settings import ALLOWED_FILES, LOGGING_LEVEL_MODULE
 
 from v0 import ai
+from v0.singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGING_LEVEL_MODULE)
 
+# how many pages of candidates the first page of a paginated search ranks, and how long the cursor to the rest of them lives
+CURSOR_PAGES = 10
+CURSOR_TIMEOUT = 60*30  # 30 minutes
+
+# identical fuzzy searches that miss the cache at the same time run their trigram query once
+fuzzy_in_flight = SingleFlight()
+
 
 def clean_str(s: str):
     """ custom string cleaner, returns normalized unicode with spaces trimmed
@@ -239,8 +248,27 @@ def generate_cache_key(*args, **kwargs):
     return str(get_hash((args, kwargs)).hex())
 
 
-def search_fuzzy_cache(model: models.Model, name: str, k=1, use_cached=True, search_field='pk', queryset=None):
-    """ Gets closest queryset object to the given name
+def vector_cache_key(namespace: bytes, vector: np.ndarray, *params) -> str:
+    """ Cache key of a query vector, hashing its raw float32 bytes instead of JSON serializing its floats like generate_cache_key would
+
+    Args:
+        namespace (bytes): Precomputed digest of everything the results depend on that does not change per query, ie the index and its QuerySet
+        vector (np.ndarray): C-contiguous float32 vector, hashed in place without copying
+        *params: Small per query params like k, reduced to their repr
+
+    Returns:
+        str: Hex digest usable as a cache key
+    """
+    key = hashlib.blake2b(namespace, digest_size=16)
+    key.update(vector)
+    key.update(repr(params).encode('utf-8'))
+    return key.hexdigest()
+
+
+def search_fuzzy_cache(model: models.Model, name: str, k=1, use_cached=True, search_field='pk', queryset=None) -> tuple[list, list[float]]:
+    """ Gets the pks of the closest queryset objects to the given name, use hydrate or search_fuzzy_first to get the objects themselves
+
+    Only the ranked pks and similarities are cached, never a QuerySet, so cache rows stay small and cheap to unpickle.
 
     Args:
         model (django.db.models.Model): Model type to search
@@ -250,8 +278,8 @@ def search_fuzzy_cache(model: models.Model, name: str, k=1, use_cached=True, sea
         search_field (str, optional): Fieldname to perform the search on for, defaults to 'pk'
         queryset (django.db.models.QuerySet, optional): QuerySet to search within, use for prefiltering, defaults to None (model.objects.all())
     Returns:
-        QuerySet: K closest matched instances, from cache if available
-        List: Pks of closest matched instances ordered by similarity
+        List: Pks of the k closest matched instances ordered by similarity, from cache if available
+        List: Trigram similarity of each of those pks
     """
 
     assert isinstance(queryset, models.query.QuerySet) or queryset is None, 'queryset must be a QuerySet or None'
@@ -261,17 +289,110 @@ def search_fuzzy_cache(model: models.Model, name: str, k=1, use_cached=True, sea
     assert isinstance(queryset.model, type(model)), 'queryset must be of the same model type as model param'
 
     # check if available in cache first
-    cache_key = generate_cache_key(str(model._meta).lower(), name, k, search_field, str(queryset.query), version=8)  # change version every time you modify this line
-    cached_results = cache.get(cache_key)
-    if use_cached and cached_results and type(cached_results) == tuple:  # if so do a simple pk lookup
-        results, results_pk = cached_results  # unpack tuple
-    else:  # if not in cache, find the closest match using trigram and store the result in cache
-        # So essentially, querysets are lazy loading
-        # so we have to force the execution now
-        # and then cache a queryset thats just filtering for the resulting pks
-        # otherwise we cache a trigram similarity query which is much slower to execute
-        results_pk = list(queryset.annotate(similarity=TrigramSimilarity(search_field, name)).order_by('-similarity')[:k].values_list('pk', flat=True))
-        results = model.objects.filter(pk__in=results_pk) # We can't use our prefiltered queryset here because it's sliced and we can't filter a sliced queryset
-        cache.set(cache_key, (results, results_pk), timeout=60*60*24*2)  # 2 day timeout
-
-    return results, results_pk
+    cache_key = generate_cache_key(str(model._meta).lower(), name, k, search_field, str(queryset.query), version=9)  # change version every time you modify this line
+    cached_results = cache.get(cache_key) if use_cached else None
+    if cached_results is not None and type(cached_results) == tuple:  # pks are cached as strings, turn them back into their field type, ie UUIDs for content
+        cached_pks, scores = cached_results
+        to_python = model._meta.pk.to_python
+        return [to_python(x) for x in cached_pks], scores
+
+    # if not in cache, find the closest matches using trigram and store them in cache, concurrent misses of the same search wait on the first one
+    results_pk, scores = fuzzy_in_flight.do(cache_key, _search_fuzzy, cache_key, name, k, search_field, queryset)
+    return list(results_pk), list(scores)  # the lists are shared with every waiter
+
+
+def _search_fuzzy(cache_key: str, name: str, k: int, search_field: str, queryset: models.QuerySet) -> tuple[list, list[float]]:
+    rankings = list(queryset.annotate(similarity=TrigramSimilarity(search_field, name)).order_by('-similarity')[:k].values_list('pk', 'similarity'))
+    results_pk, scores = [pk for pk, similarity in rankings], [similarity for pk, similarity in rankings]
+    cache.set(cache_key, ([str(x) for x in results_pk], scores), timeout=60*60*24*2)  # 2 day timeout
+    return results_pk, scores
+
+
+def hydrate(model: models.Model, pks: list, fields: list[str] | None = None) -> list:
+    """ Fetch the objects of a ranked list of pks in a single query, in the order of the pks
+
+    Args:
+        model (django.db.models.Model): Model of the pks
+        pks (list): Ranked pks, ie from search_fuzzy_cache or a VectorIndex
+        fields (list[str], optional): If given, return dicts of these fields rather than model instances, must include 'pk'. Defaults to None.
+
+    Returns:
+        list: Objects or dicts of the pks that still exist, in the order of pks
+    """
+    if fields is None:
+        objects = model.objects.in_bulk(pks)
+    else:
+        objects = {x['pk']: x for x in model.objects.filter(pk__in=pks).values(*fields)}
+    return [objects[pk] for pk in pks if pk in objects]
+
+
+def search_fuzzy_first(model: models.Model, names: list[str]) -> list:
+    """ Closest object to each of the names, with one query for all their objects rather than one per name
+
+    Args:
+        model (django.db.models.Model): Model type to search
+        names (list[str]): Names to find the closest match to
+
+    Returns:
+        list: Per name its closest object, None if there was no match
+    """
+    pks = search_fuzzy_first_pks(model, names)
+    objects = model.objects.in_bulk({pk for pk in pks if pk is not None})
+    return [objects.get(pk) for pk in pks]
+
+
+def search_fuzzy_first_pks(model: models.Model, names: list[str]) -> list:
+    """ Pk of the closest object to each of the names, None if there was no match, straight from the cache when the names were searched before """
+    return [next(iter(search_fuzzy_cache(model, x)[0]), None) for x in names]
+
+
+def cursor_identity(path: str, params: dict) -> tuple[str, dict]:
+    """ What a cursor is bound to, the endpoint and every parameter of its request but the ones that only pick the page """
+    return path, {x: y for x, y in params.items() if x not in ('cursor', 'page')}
+
+
+def cursor_page(k: int, cursor: str | None, search: Callable[[int], list[list]], page: int = 0, identity: object = None) -> tuple[list[list], str | None]:
+    """ Serve a page of k results from a ranked candidate list that is searched once and cached behind an opaque cursor
+
+    The first page calls search for enough candidates to fill CURSOR_PAGES pages and caches them, every later page is a slice of that list, so deep pages cost the same as the first.
+    A list that came back full may not hold every candidate, so a page that runs past it searches again for CURSOR_PAGES more pages.
+    The candidates of the pages already served are kept as they are and only the new ones of the deeper search are appended, so mmr or a rebuilt index can not reorder what the client has seen.
+
+    Args:
+        k (int): Number of results per page
+        cursor (str | None): The next_cursor returned with the previous page, None to start a new search
+        search (Callable[[int], list[list]]): Given a number of candidates, returns up to that many ranked pk and score pairs for each query of the request. Called for the first page and when a page runs past the cached candidates.
+        page (int, optional): Page to start at when cursor is None, for clients that still paginate by page number. Defaults to 0.
+        identity (object, optional): What the search is, see cursor_identity, a cursor is only accepted by the search it was returned by. Defaults to None.
+
+    Returns:
+        list[list]: Per query, the candidates of the page
+        str | None: Cursor of the next page, None if there are no more candidates
+
+    Raises:
+        ValueError: If the cursor is malformed, has expired or belongs to another search
+    """
+    identity = generate_cache_key(identity)
+    if cursor is None:
+        token, offset = uuid4().hex, page*k
+        n, candidates = 0, []
+    else:
+        token, _, offset = cursor.partition('.')
+        entry = cache.get(generate_cache_key('cursor', token))
+        if entry is None or not offset.isdigit() or entry['identity'] != identity:
+            raise ValueError('Cursor is invalid, has expired or belongs to another search, start again without a cursor')
+        n, candidates, offset = entry['n'], entry['candidates'], int(offset)
+
+    full = any(len(x) >= n for x in candidates)  # the search may have had more to give
+    if cursor is None or (full and offset+k > n):
+        n = offset+k*CURSOR_PAGES
+        deeper = search(n)
+        full = any(len(x) >= n for x in deeper)
+        if cursor is not None:
+            served = [x[:offset] for x in candidates]
+            deeper = [x+[y for y in more if y[0] not in {pk for pk, score in x}] for x, more in zip(served, deeper)]
+        candidates = deeper
+        cache.set(generate_cache_key('cursor', token), {'identity': identity, 'n': n, 'candidates': candidates}, timeout=CURSOR_TIMEOUT)
+
+    next_cursor = f'{token}.{offset+k}' if full or any(len(x) > offset+k for x in candidates) else None
+    return [x[offset:offset+k] for x in candidates], next_cursor
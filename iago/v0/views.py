@@ -2,13 +2,14 @@ import logging
 import threading
 import time
 from multiprocessing.pool import ThreadPool
+from uuid import UUID
 
 import jsonschema
 import numpy as np
 from django.core.cache import cache
 from django.db import models
 from drf_spectacular.utils import extend_schema
-from iago.settings import DEBUG, LOGGING_LEVEL_MODULE
+from iago.settings import LOGGING_LEVEL_MODULE
 from rest_framework import status, views
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
@@ -17,11 +18,11 @@ from rest_framework.request import Request
 from v0 import ai, index
 from v0 import serializers
 from v0.article import updateArticle
-from v0.models import Content, Job, MindtoolsSkillGroup, Skill, Topic, HUMAN_TO_MODEL
+from v0.models import Content, Job, MindtoolsSkillGroup, Skill, HUMAN_TO_MODEL
 from v0.pdf import ingestContentPDF
 from v0.schemas import schemas_request, schemas_response
 from v0.serializers import fileUploadSerializer
-from v0.utils import allowedFile, is_valid_uuid, search_fuzzy_cache
+from v0.utils import allowedFile, cursor_identity, cursor_page, hydrate, is_valid_uuid, search_fuzzy_cache, search_fuzzy_first, search_fuzzy_first_pks
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGING_LEVEL_MODULE)
@@ -46,12 +47,13 @@ class skills_match(views.APIView):
         # embed all texts in batch
         embeds = ai.embedding_model.encode(texts)
 
+        # find the closest skills for every text/vector in one search
+        skills, rankings_batch, query_vectors = index.get_index('skill').query_batch(embeds, k=10, min_distance=.21, hydrate=False)  # NOTE these are hardcoded for now, important params if you want to change results
+
         results = []
-        # find skills for each text/vector and populate results
-        for embed in embeds:
-            # find the closest skills
-            skills, rankings, query_vector = index.skills_index.query(embed, k=10, min_distance=.21)  # NOTE these are hardcoded for now, important params if you want to change results
-            skills_ranked = list(zip(*rankings))[0]  # rankings are keyed by pk which in skill objects case is the name
+        # populate results for each text/vector
+        for embed, rankings in zip(embeds, rankings_batch):
+            skills_ranked = [pk for pk, score in rankings]  # rankings are keyed by pk which in skill objects case is the name
 
             # add to results
             results.append({
@@ -74,12 +76,16 @@ class skills_match_embeds(views.APIView):
         except jsonschema.exceptions.ValidationError as err:
             return Response({'response': err.message, 'schema': err.schema}, status=status.HTTP_400_BAD_REQUEST)
 
+        # find the closest skills for every vector in one search
+        try:
+            skills, rankings_batch, query_vectors = index.get_index('skill').query_batch(request.data['embeds'], k=10, min_distance=.21, hydrate=False)  # NOTE these are hardcoded for now, important params if you want to change results
+        except ValueError as err:
+            return Response({'response': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
         results = []
-        # find skills for each text/vector and populate results
-        for embed in request.data['embeds']:
-            # find the closest skills
-            skills, rankings, query_vector = index.skills_index.query(embed, k=10, min_distance=.21)  # NOTE these are hardcoded for now, important params if you want to change results
-            skills_ranked = list(zip(*rankings))[0]  # rankings are keyed by pk which in skill objects case is the name
+        # populate results for each vector
+        for rankings in rankings_batch:
+            skills_ranked = [pk for pk, score in rankings]  # rankings are keyed by pk which in skill objects case is the name
 
             # add to results
             results.append({
@@ -107,16 +113,21 @@ class skills_adjacent(views.APIView):
 
         # for each skill in the query, find its closest match in the skills database
         # skills is a list of results lists, but we only ask for 1 result per (sometimes if there are no matches it returns an empty list, so make sure that doesnt cause an error)
-        skills = [search_fuzzy_cache(Skill, x)[0].first() for x in query_skills]
+        # the pk of a skill is its name and its embedding is in the skills index, so we never need the skill rows themselves
+        skill_pks = search_fuzzy_first_pks(Skill, query_skills)
+        vectors, found = index.get_index('skill').get_vectors([pk for pk in skill_pks if pk is not None])
+        matched = [(skill, skill_name) for skill, skill_name in zip(skill_pks, query_skills) if skill is not None]
+        matched, vectors = [x for x, is_found in zip(matched, found) if is_found], vectors[found]
+        if len(matched) == 0:
+            return Response({'skills': []}, status=status.HTTP_200_OK)
 
-        adjacent_skills = []
-        for skill, skill_name in zip(skills, query_skills):
-            if skill is not None:
-                # get adjacent skills for our skill
-                results, rankings, query_vector = index.skills_index.query(skill.embedding_all_mpnet_base_v2, k=k+1, min_distance=temperature)  # we have to add one to k because the first result is always going to be the provided skill itself
-                skills_ranked = list(zip(*rankings))[0]
+        # get adjacent skills for all our skills in one search
+        results, rankings_batch, query_vectors = index.get_index('skill').query_batch(vectors, k=k+1, min_distance=temperature, hydrate=False)  # we have to add one to k because the first result is always going to be the provided skill itself
 
-                adjacent_skills.append({'name': skill.name, 'original': skill_name, 'adjacent': skills_ranked[1:k+1]})
+        adjacent_skills = []
+        for (skill, skill_name), rankings in zip(matched, rankings_batch):
+            skills_ranked = [pk for pk, score in rankings]
+            adjacent_skills.append({'name': skill, 'original': skill_name, 'adjacent': skills_ranked[1:k+1]})
 
         return Response({'skills': adjacent_skills}, status=status.HTTP_200_OK)
 
@@ -128,22 +139,23 @@ class index_rebuild(views.APIView):
     """ rebuild the index """
 
     def put(self, request: Request, index_choice: str):
-        if index_choice == 'topic':
-            query_index = index.topic_index
-        elif index_choice == 'skill':
-            query_index = index.skills_index
-        elif index_choice == 'content':
-            query_index = index.content_index
-        elif index_choice == 'unsplash':
-            query_index = index.unsplash_photo_index
-        elif index_choice == 'vodafone':
-            query_index = index.vodafone_index
-        else:
-            return Response({'response': f'invalid index {index_choice}'}, status=status.HTTP_400_BAD_REQUEST)
+        query_index = index.indexes.get(index_choice)
+        if query_index is None:
+            return Response({'response': f'invalid index {index_choice}, available: {list(index.indexes)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # the rebuild runs in the background and is swapped in when done, queries keep being served from the current index meanwhile
+        job = query_index.rebuild_async()
+        return Response({'response': 'rebuild started', 'job': job.as_dict()}, status=status.HTTP_202_ACCEPTED)
+
 
-        query_index._generate_index()  # it aint smooth, worried about mem-lock but whatever
+class index_rebuild_status(views.APIView):
+    """ status and timing of a rebuild job """
 
-        return Response({'response': 'success'}, status=status.HTTP_200_OK)
+    def get(self, request: Request, index_choice: str, job_id: str):
+        job = index.get_rebuild_job(job_id)
+        if job is None or job['index'] != index_choice:
+            return Response({'response': f'no rebuild job {job_id} for index {index_choice}'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'job': job}, status=status.HTTP_200_OK)
 
 
 class index_query(views.APIView):
@@ -158,19 +170,11 @@ class index_query(views.APIView):
         k = int(request.data['k'])
         temperature = float(request.data.get('temperature', 0)/100)  # default to 0
         page: int = request.data.get('page', 0)
+        cursor: str | None = request.data.get('cursor')
 
-        if index_choice == 'topic':
-            query_index = index.topic_index
-        elif index_choice == 'skill':
-            query_index = index.skills_index
-        elif index_choice == 'content':
-            query_index = index.content_index
-        elif index_choice == 'unsplash':
-            query_index = index.unsplash_photo_index
-        elif index_choice == 'vodafone':
-            query_index = index.vodafone_index
-        else:
-            return Response({'response': f'invalid index {index_choice}'}, status=status.HTTP_400_BAD_REQUEST)
+        query_index = index.indexes.get(index_choice)
+        if query_index is None:
+            return Response({'response': f'invalid index {index_choice}, available: {list(index.indexes)}'}, status=status.HTTP_400_BAD_REQUEST)
 
         # get model and fields
         model = query_index.model
@@ -184,32 +188,25 @@ class index_query(views.APIView):
         if not 'pk' in fields: # must return pk to do the ranking later
             fields.append('pk')
 
-        # do the actual search
-        results, rankings, query_vector = query_index.query(query, k*(page+1), temperature)
-        
-        results_pk_to_return_ranked, scores = zip(*[(x, score) for x, score in rankings[page*k:(page+1)*k]])
+        # do the actual search, only for the first page, later pages are sliced from the candidates cached behind the cursor
+        query_vector = None  # only known when we search
+        def search(n):
+            nonlocal query_vector
+            results, rankings, query_vector = query_index.query(query, n, temperature)
+            return [rankings]
+        try:
+            (rankings,), next_cursor = cursor_page(k, cursor, search, page, cursor_identity(request.path, request.data))
+        except ValueError as err:
+            return Response({'response': str(err)}, status=status.HTTP_400_BAD_REQUEST)
 
         # finally get the fields from the results that we want
-        if fields == ['pk']: # no need to hit the db again if we just want the pks, also makes it so we dont need to rerank
-            results_to_return = results_pk_to_return_ranked
-        else: # otherwise return a list of dicts if we want multiple fields. means we also need to rank the results of the queryset since the database hit is unordered
-            results_to_return = list(results.values(*fields))
-
-            # Sort based on ranking.
-            # One thing to note is that the results list is not ordered or offset/truncated, but the results_pk list is, 
-            # so a workaround to sorting the entire list which potentially could be really long based on the k and page value is to asssign -1
-            # to the pk of any results that are not in the results_pk_to_return_ranked list, which potentially are actually higher ranked but
-            # we don't want to return them because of the k/page value
-            results_to_return = sorted(results_to_return, key=lambda result: results_pk_to_return_ranked.index(result['pk']) if result['pk'] in results_pk_to_return_ranked else -1)
-
-            # Now that we have the results sorted, we can return the correct number and offset of results based on the page/k value
-            results_to_return = results_to_return[page*k:(page+1)*k]
-
-            # Annotate with score that we used to rank
-            for i, result in enumerate(results_to_return):
-                result['score'] = scores[i]
+        if fields == ['pk']: # no need to hit the db again if we just want the pks
+            results_to_return = [pk for pk, score in rankings]
+        else: # otherwise return a list of dicts, annotated with the score we used to rank, in rank order since the database hit is unordered
+            results_data = {result['pk']: result for result in model.objects.filter(pk__in=[pk for pk, score in rankings]).values(*fields)}
+            results_to_return = [dict(results_data[pk], score=score) for pk, score in rankings if pk in results_data]
 
-        return Response({'results': results_to_return, 'query_vector': query_vector}, status=status.HTTP_200_OK)
+        return Response({'results': results_to_return, 'query_vector': query_vector, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
 # * Content Views
 
@@ -230,8 +227,14 @@ class content_update(views.APIView):
         logger.info(f'Getting articles took {time.perf_counter()-start:.3f}s')
         logger.info(f'Updating data for {len(articles_uuid)} articles')
 
+        # the content indexes are synced per article but their cached rankings are invalidated once for the whole batch
+        def invalidate(changed: list[bool]):
+            if any(changed):
+                for vector_index in index.content_indexes():
+                    vector_index.invalidate_cache()
+
         pool = ThreadPool(processes=4)
-        pool.map_async(updateArticle, articles_uuid)
+        pool.map_async(updateArticle, articles_uuid, callback=invalidate)
 
         return Response({'response': 'started', 'count': len(articles_uuid)}, status=status.HTTP_200_OK)
 
@@ -296,22 +299,22 @@ class content_via_adjacent_skills(views.APIView):
         page: int = request.data.get('page', 0)
 
         # start = time.perf_counter()
-        skills = [search_fuzzy_cache(Skill, x)[0].first() for x in query_skills]
-        skills = [x for x in skills if x]  # remove nones
+        # skill pks are their names and their embeddings are in the skills index, so the skill rows are never loaded
+        matched = [(skill, skill_name) for skill, skill_name in zip(search_fuzzy_first_pks(Skill, query_skills), query_skills) if skill is not None]  # remove nones
+        vectors, found = index.get_index('skill').get_vectors([skill for skill, skill_name in matched])
+        matched, vectors = [x for x, is_found in zip(matched, found) if is_found], vectors[found]
 
-        # okay now we need to get adjacent skills
+        # okay now we need to get adjacent skills, for all our skills in one search
         adjacent_skills_dict = []
         adjacent_skills = []
-        for skill, skill_name in zip(skills, query_skills):
-            if skill is not None:
-                # get adjacent skills for our skill
-                results, rankings, query_vector = index.skills_index.query(skill.embedding_all_mpnet_base_v2, k=5)
+        if len(matched) > 0:
+            results, rankings_batch, query_vectors = index.get_index('skill').query_batch(vectors, k=5, hydrate=False)
+            for (skill, skill_name), rankings in zip(matched, rankings_batch):
                 # unpack the rankings and make a ranked list of pks and a ranked list of scores
-                unpacked = list(zip(*rankings))
-                skills_ranked = unpacked[0]
-                scores_ranked = unpacked[1]
+                skills_ranked = [pk for pk, score in rankings]
+                scores_ranked = [score for pk, score in rankings]
 
-                adjacent_skills_dict.append({'name': skill.name, 'original': skill_name, 'adjacent': skills_ranked[1:], 'scores': scores_ranked[1:]})
+                adjacent_skills_dict.append({'name': skill, 'original': skill_name, 'adjacent': skills_ranked[1:], 'scores': scores_ranked[1:]})
                 adjacent_skills.extend(skills_ranked[1:])
 
         # skills tag search
@@ -361,9 +364,9 @@ class content_via_skills(views.APIView):
 
         # Validate skill group
         if skill_group == 'mindtools':
-            skill_group_model = MindtoolsSkillGroup
+            skill_group_model, skill_group_index = MindtoolsSkillGroup, index.get_index('mindtools_group')
         elif skill_group == 'all':
-            skill_group_model = Skill
+            skill_group_model, skill_group_index = Skill, index.get_index('skill')
         else:
             return Response({'response': f'Invalid skill group {skill_group}. Valid: mindtools, all'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -377,53 +380,51 @@ class content_via_skills(views.APIView):
         content_type: list | None = serializer.data.get('content_type')
         provider: list | None = serializer.data.get('provider')
 
-        skills = [search_fuzzy_cache(skill_group_model, x)[0].first() for x in query_skills]
-        skills = [x for x in skills if x]  # remove nones
+        # skill pks are their names and their embeddings are in the index of the skill group, so the skill rows are never loaded
+        skills = [x for x in search_fuzzy_first_pks(skill_group_model, query_skills) if x is not None]  # remove nones
+        vectors, found = skill_group_index.get_vectors(skills)
+        skills, vectors = [x for x, is_found in zip(skills, found) if is_found], vectors[found]
 
         if len(skills) == 0:
             return Response({'response': f'No skills found'}, status=status.HTTP_200_OK)
 
         if individual_skill_recommendations:
-            query_vectors = [(x.name, x.embedding_all_mpnet_base_v2) for x in skills]
+            query_vectors = list(zip(skills, vectors))
         else:
-            average = np.mean([x.embedding_all_mpnet_base_v2 for x in skills], axis=0).astype(np.float32)
+            average = np.mean(vectors, axis=0).astype(np.float32)
             query_vectors = [('all_skills', average)]
 
-        # Get semantic search results for each query vector
-        results_total = []
-        for skill_name, query_vector in query_vectors:
-            results, rankings, query_vector = index.content_index.query(query_vector, k=k*(page+1)*10) # multiply by 10 to get more results so that we can hopefully match k results after filtering - not the best solution but fine for now
-            # unpack the rankings and make a ranked list of pks and a ranked list of scores
-            skills_ranked, scores_ranked = list(zip(*rankings))
-
-            # get the content ids for the ranked skills
-            results_to_return = Content.objects.filter(uuid__in=skills_ranked)
-
-            # apply filters to queryset
-            if content_type:
-                results_to_return = results_to_return.filter(type__in=content_type)
-            if provider:
-                results_to_return = results_to_return.filter(provider__in=provider)
-            results_to_return = results_to_return.distinct('uuid')
+        # filters are applied inside the search, so every query gets exactly the results of its page
+        filters = {}
+        if content_type:
+            filters['type__in'] = content_type
+        if provider:
+            filters['provider__in'] = provider
 
-            # Perform the transaction and get the fields we want
-            results_to_return_data = list(results_to_return.values(*fields))
+        # Get semantic search results for all query vectors in a single search on the first page, later pages are sliced from the candidates cached behind the cursor
+        def search(n):
+            results, rankings_batch, query_vectors_matrix = index.get_index('content').query_batch([query_vector for skill_name, query_vector in query_vectors], k=n, hydrate=False, filters=filters)
+            return rankings_batch
+        try:
+            rankings_batch, next_cursor = cursor_page(k, serializer.data.get('cursor'), search, page, cursor_identity(request.path, serializer.data))
+        except ValueError as err:
+            return Response({'response': str(err)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Rank the results by score
-            results_to_return_data = sorted(results_to_return_data, key=lambda result: skills_ranked.index(result['pk']))
+        # get the fields we want for the ranked pks of every query in one transaction
+        results_to_return_data = {result['pk']: result for result in Content.objects.filter(uuid__in={pk for rankings in rankings_batch for pk, score in rankings}).values(*fields)}
 
-            # Slice the final list to get the page we want
-            results_to_return_data = results_to_return_data[page*k:(page+1)*k]
+        results_total = []
+        for (skill_name, query_vector), rankings in zip(query_vectors, rankings_batch):
+            ranked = [(pk, score) for pk, score in rankings if pk in results_to_return_data]
 
-            # Annotate each with the score
-            for result in results_to_return_data:
-                result['score'] = scores_ranked[skills_ranked.index(result['pk'])]
+            # Annotate each with the score, copy since the same content can be a result of multiple queries
+            content = [dict(results_to_return_data[pk], score=score) for pk, score in ranked]
 
             # Add the results to the total results list
-            results_total.append({'query': skill_name, 'count': len(results_to_return_data), 'content': results_to_return_data})
+            results_total.append({'query': skill_name, 'count': len(content), 'content': content})
 
         # add the aux data and respond
-        resp = {'results': results_total}
+        resp = {'results': results_total, 'next_cursor': next_cursor}
         resp['for_humans'] = 'Results genereated via all_mpnet_base_v2 embeddings and FAISS Euclidean Semantic Similarity'
         return Response(resp, status=status.HTTP_200_OK)
 
@@ -451,17 +452,22 @@ class content_via_search(views.APIView):
         strict = request.data.get('strict', False)
         page: int = request.data.get('page', 0)
 
-        content_to_return = Content.objects.none()
-
-        # if we have a query then we want to search content titles for it
+        # if we have a query then we want to search content titles for it, the filters are applied inside the search so the rankings need no second pass
         if query_string:
-            results, rankings, query_vector = index.content_index.query(query_string, k=k*(page+2))  # plus 2 instead of 1 cuz im just gonna get extra results to ensure we have enough to ensure k values after filters
-            content_to_return |= results
+            filters = {}
+            if content_type:
+                filters['type__in'] = content_type
+            if provider:
+                filters['provider__in'] = provider
+            if length:
+                filters['content_read_seconds__range'] = length
+            results, rankings, query_vector = index.get_index('content').query(query_string, k=k*(page+1), filters=filters)
+            content_ids_to_return_ranked = [x for x, score in rankings]
 
         # otherwise we have skills provided, for each skill in the query, find its closest match in the skills database
         elif query_skills:
-            skills = [search_fuzzy_cache(Skill, x)[0] for x in query_skills]
-            skills = [x[0] for x in skills if len(x) > 0]  # remove none values
+            content_to_return = Content.objects.none()
+            skills = [x for x in search_fuzzy_first(Skill, query_skills) if x is not None]  # remove none values
 
             # skills tag search
             if strict and len(skills) > 0:
@@ -469,33 +475,30 @@ class content_via_search(views.APIView):
             elif len(skills) > 0:
                 content_to_return |= Content.objects.filter(skills__in=skills)
 
-        # apply filters to content_to_return queryset
+            # apply filters to content_to_return queryset
 
-        # type filter
-        if content_type:
-            content_to_return = content_to_return.filter(type__in=content_type)
-
-        # provider filter
-        if provider:
-            content_to_return = content_to_return.filter(provider__in=provider)
+            # type filter
+            if content_type:
+                content_to_return = content_to_return.filter(type__in=content_type)
 
-        # length filter
-        if length:
-            content_to_return = content_to_return.filter(content_read_seconds__lte=length[1], content_read_seconds__gte=length[0])
+            # provider filter
+            if provider:
+                content_to_return = content_to_return.filter(provider__in=provider)
 
-        # unique filter
-        content_to_return = content_to_return.distinct('uuid')
+            # length filter
+            if length:
+                content_to_return = content_to_return.filter(content_read_seconds__lte=length[1], content_read_seconds__gte=length[0])
 
-        # perform the transaction to get all uuids, not limited by k or page because we havent ranked them yet
-        content_ids_to_return = list(content_to_return.values_list('uuid', flat=True))
-        if len(content_ids_to_return) == 0:
-            return Response({'response': 'No matching skills or content titles found', 'content': []}, status=status.HTTP_206_PARTIAL_CONTENT)
+            # unique filter
+            content_to_return = content_to_return.distinct('uuid')
 
-        # build a ranked list of the content from the rankings provided by the indexer, which are already ordered by similarity
-        if query_string:
-            content_ids_to_return_ranked = [x for x, score in rankings if x in content_ids_to_return]  # ensure the result passed our filters
+            # perform the transaction to get all uuids, not limited by k or page because we havent ranked them yet
+            content_ids_to_return_ranked = list(content_to_return.values_list('uuid', flat=True))
         else:
-            content_ids_to_return_ranked = content_ids_to_return
+            content_ids_to_return_ranked = []
+
+        if len(content_ids_to_return_ranked) == 0:
+            return Response({'response': 'No matching skills or content titles found', 'content': []}, status=status.HTTP_206_PARTIAL_CONTENT)
 
         # slice the content_ids_to_return_ranked list to get the page we want
         content_ids_to_return_ranked = content_ids_to_return_ranked[page*k:(page+1)*k]
@@ -505,10 +508,7 @@ class content_via_search(views.APIView):
         if fields:
             if not 'pk' in fields:
                 fields.append('pk')
-            content_to_return = Content.objects.filter(uuid__in=content_ids_to_return_ranked)
-            content_to_return = list(content_to_return.values(*fields))
-            content_to_return = sorted(content_to_return, key=lambda result: content_ids_to_return_ranked.index(result['pk'])) 
-            resp = {'content': content_to_return}
+            resp = {'content': hydrate(Content, content_ids_to_return_ranked, fields)}
         else:
             resp = {'content': content_ids_to_return_ranked}
 
@@ -532,90 +532,85 @@ class content_via_recommendation(views.APIView):
 
         # first match the free-form job title provided to one embedded in our database
         position: str = request.data['position']
-        job: Job = search_fuzzy_cache(Job, position)[0].first()
+        job: str | None = search_fuzzy_first_pks(Job, [position])[0]  # the pk of a job is its name
         if job is None:
             return Response({'response': 'No matching job title found'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # next get content objects with the provided content history ids
-        content_history: list[Content] = []
-        for content_id in request.data['lastconsumedcontent']:
-            if is_valid_uuid(content_id):
-                try:
-                    content = Content.objects.get(uuid=content_id)
-                    content_history.append(content)
-                except Content.DoesNotExist:
-                    return Response({'response': f'Content with UUID {content_id} does not exist', 'content': []}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response({'response': f'Invalid UUID {content_id}', 'content': []}, status=status.HTTP_400_BAD_REQUEST)
-
-        # we can only generate a content history embedding center if we actually have a history
-        if not len(content_history) == 0:
-            # now get the center of the content history embeddings
-            content_history_vectors = np.array([x.embedding_all_mpnet_base_v2 for x in content_history]).astype(np.float32)
-            content_history_center = np.average(content_history_vectors, axis=0)
-
-            # get the weights of job and history and compute the center of the recomendation in the embedding space
-            job_weight, history_weight = request.data.get('weights', (1, 1))  # default to equal weights
-            recomendation_center = np.average([np.array(job.embedding_all_mpnet_base_v2), content_history_center], axis=0, weights=[job_weight, history_weight])
-        else:  # otherwise we can just use the job embedding
-            recomendation_center = np.array(job.embedding_all_mpnet_base_v2)
+        # the recommendation center only needs computing to search, which the first page does and later pages only when they run past the candidates behind the cursor
+        cursor: str | None = request.data.get('cursor')
+
+        def get_recomendation_center() -> np.ndarray:
+            """ raises ValueError with the response to give if the request does not make a recommendation center """
+            # next get the embeddings of the provided content history ids, from the content index rather than the database
+            content_history: list[UUID] = []
+            for content_id in request.data['lastconsumedcontent']:
+                if not is_valid_uuid(content_id):
+                    raise ValueError(f'Invalid UUID {content_id}')
+                content_history.append(UUID(content_id))
+            content_history_vectors, found = index.get_index('content').get_vectors(content_history)
+            if not found.all():
+                raise ValueError(f'Content with UUID {content_history[np.argmin(found)]} does not exist')
+            job_vector = index.get_index('job').get_vector(job)
+            if job_vector is None:  # the match was cached before the job was deleted
+                raise ValueError('No matching job title found')
+
+            # we can only generate a content history embedding center if we actually have a history
+            if not len(content_history) == 0:
+                # now get the center of the content history embeddings
+                content_history_center = np.average(content_history_vectors, axis=0)
+
+                # get the weights of job and history and compute the center of the recomendation in the embedding space
+                job_weight, history_weight = request.data.get('weights', (1, 1))  # default to equal weights
+                return np.average([job_vector, content_history_center], axis=0, weights=[job_weight, history_weight])
+            else:  # otherwise we can just use the job embedding
+                return job_vector
 
         # now get the closest k content to the recomendation center via our faiss index
         k: int = request.data['k']
         page: int = request.data.get('page', 0)  # default to 0
         temperature = float(request.data.get('temperature', 0)/100)  # default to 0
-        p = 10 if temperature == 0 else 1  # if temp is 0 we want to multiply k because it wont get multiplied by p within the query method
 
-        results, rankings, query_vector = index.content_index.query(recomendation_center, k=k*(page+1), min_distance=temperature, truncate_results=False)
+        mmr_lambda = request.data.get('mmr_lambda')  # optional relevance/diversity trade-off, None keeps the plain similarity ranking
 
-        content_to_return = results
-
-        # apply filters
+        # filters are applied inside the search, so the rankings only hold content that passed them
         content_type = request.data.get('type')
         length = request.data.get('length')
         provider = request.data.get('provider')
-        # type filter
+        filters = {}
         if content_type:
-            content_to_return = content_to_return.filter(type__in=content_type)
-
-        # length filter
+            filters['type__in'] = content_type
         if length:
-            content_to_return = content_to_return.filter(content_read_seconds__lte=length[1], content_read_seconds__gte=length[0])
-
-        # provider filter
+            filters['content_read_seconds__range'] = length
         if provider:
-            content_to_return = content_to_return.filter(provider__in=provider)
-
-        # unique filter
-        content_to_return = content_to_return.distinct('uuid')
+            filters['provider__in'] = provider
 
-        # evaluate the queryset and get the ids
-        content_ids_to_return = list(content_to_return.values_list('uuid', flat=True))
+        def search(n):
+            results, rankings, query_vector = index.get_index('content').query(get_recomendation_center(), k=n, min_distance=temperature, mmr_lambda=mmr_lambda, filters=filters)
+            return [rankings]
+        try:
+            (rankings,), next_cursor = cursor_page(k, cursor, search, page, cursor_identity(request.path, request.data))
+        except ValueError as err:
+            return Response({'response': str(err), 'content': []}, status=status.HTTP_400_BAD_REQUEST)
 
-        # build a ranked list of the content ids from the rankings provided by the indexer, which are already ordered by similarity to the recomendation center vector
-        # ensure the result passed our filters and get the scores for the content ids to return
-        content_ids_to_return_ranked, scores = zip(*[(x, score) for x, score in rankings if x in content_ids_to_return])
-
-        # slice the content_ids_to_return_ranked list to get the page we want
-        content_ids_to_return_ranked = content_ids_to_return_ranked[page*k:(page+1)*k]
+        # the rankings are already ordered by similarity to the recomendation center vector and sliced to the page we want
+        content_ids_to_return_ranked = [x for x, score in rankings]
+        scores = dict(rankings)
 
         # determine if we want to return fields or just uuid
         fields = request.data.get('fields')
         if fields: # TODO: validate the fields dynamically, already wrote the code just have to port it here i think its in object search
             if not 'pk' in fields:
                 fields.append('pk')
-            content_to_return = Content.objects.filter(uuid__in=content_ids_to_return_ranked)
-            content_to_return = list(content_to_return.values(*fields))
-            content_to_return = sorted(content_to_return, key=lambda result: content_ids_to_return_ranked.index(result['pk']))
-            # annotate the content with the score
-            for i, content in enumerate(content_to_return):
-                content['score'] = scores[i]
+            content_data = {result['pk']: result for result in Content.objects.filter(uuid__in=content_ids_to_return_ranked).values(*fields)}
+            # put the content back in rank order and annotate it with the score
+            content_to_return = [dict(content_data[pk], score=scores[pk]) for pk in content_ids_to_return_ranked if pk in content_data]
             resp = {'content': content_to_return}
         else:
             resp = {'content': content_ids_to_return_ranked}
 
         # add the aux data and respond
-        resp['matched_job'] = job.name
+        resp['matched_job'] = job
+        resp['next_cursor'] = next_cursor
         return Response(resp, status=status.HTTP_200_OK)
 
 
@@ -652,16 +647,10 @@ class content_via_title(views.APIView):
             content_to_return = content_to_return.filter(provider__in=provider)
 
         # get the closest k content to the query via our fuzzy search
-        content_to_return, rankings = search_fuzzy_cache(Content, query, k=int(k*(page+1)), search_field='title', queryset=content_to_return)
-        
-        # unique filter
-        content_to_return = content_to_return.distinct('uuid')
-
-        # evaluate the queryset and get the ids
-        content_ids_to_return = list(content_to_return.values_list('uuid', flat=True))
+        rankings, scores = search_fuzzy_cache(Content, query, k=int(k*(page+1)), search_field='title', queryset=content_to_return)
 
-        # build a ranked list of the content ids from the rankings provided by the fuzzy search, which are already ordered by similarity to the query
-        content_ids_to_return_ranked = [x for x in rankings if x in content_ids_to_return]  # ensure the result passed our filters
+        # the rankings are already ordered by similarity to the query and only hold content that passed our filters, just make them unique
+        content_ids_to_return_ranked = list(dict.fromkeys(rankings))
 
         # slice the content_ids_to_return_ranked list to get the page we want
         content_ids_to_return_ranked = content_ids_to_return_ranked[page*k:(page+1)*k]
@@ -671,10 +660,7 @@ class content_via_title(views.APIView):
         if fields:
             if not 'pk' in fields:
                 fields.append('pk')
-            content_to_return = Content.objects.filter(uuid__in=content_ids_to_return_ranked)
-            content_to_return = list(content_to_return.values(*fields))
-            content_to_return = sorted(content_to_return, key=lambda result: content_ids_to_return_ranked.index(result['pk'])) 
-            resp = {'content': content_to_return}
+            resp = {'content': hydrate(Content, content_ids_to_return_ranked, fields)}
         else:
             resp = {'content': content_ids_to_return_ranked}
 
@@ -726,14 +712,10 @@ class stringEmbeddingCRUD(views.APIView):
             object.create(name, ai.embedding_model.encode([name])[0])
             object.save()
 
-            if not DEBUG:
-                if model == Topic:
-                    target = index.topic_index._generate_index()
-                elif model == Skill:
-                    target = index.skills_index._generate_index()
-                elif model == Job:
-                    target = index.jobs_index._generate_index()
-                threading.Thread(target=target).start()
+            # add just the new object to its index instead of regenerating the whole thing, if this deployment has that index
+            query_index = index.indexes.get(model_choice)
+            if query_index is not None:
+                query_index.upsert(object.pk, object.embedding_all_mpnet_base_v2)
 
             return Response({'response': f'{name} created'}, status=status.HTTP_201_CREATED)
 
@@ -747,14 +729,10 @@ class stringEmbeddingCRUD(views.APIView):
         if model.objects.filter(name=name).count() > 0:
             model.objects.get(name=name).delete()
 
-            if not DEBUG:
-                if model == Topic:
-                    target = index.topic_index._generate_index()
-                elif model == Skill:
-                    target = index.skills_index._generate_index()
-                elif model == Job:
-                    target = index.jobs_index._generate_index()
-                threading.Thread(target=target).start()
+            # tombstone just the deleted object instead of regenerating the whole index, if this deployment has that index
+            query_index = index.indexes.get(model_choice)
+            if query_index is not None:
+                query_index.remove(name)
 
             return Response({'response': f'{name} deleted'}, status=status.HTTP_200_OK)
         else:
@@ -807,15 +785,16 @@ class model_field_search(views.APIView):
             return Response(f'{model_choice} field {search_field} is not a string field', status=status.HTTP_400_BAD_REQUEST)
 
         # perform the search
-        results, results_pk = search_fuzzy_cache(model, query, k, search_field=search_field)
+        results_pk, scores = search_fuzzy_cache(model, query, k, search_field=search_field)
 
-        # finally get the fields we want
+        # finally get the fields we want, in rank order
         if fields == ['pk']: # no need to hit the db again if we just want the pks
             results_to_return = results_pk
         elif len(fields) == 1: # return a flat list of values if we only want one field
-            results_to_return = results.values_list(fields[0], flat=True)
+            results_to_return = [x[fields[0]] for x in hydrate(model, results_pk, ['pk', *fields])]
         else: # otherwise return a list of dicts if we want multiple fields
-            results_to_return = results.values(*fields)
+            results_to_return = hydrate(model, results_pk, list({'pk', *fields}))
+            results_to_return = [{field: x[field] for field in fields} for x in results_to_return]
 
         return Response({'results': results_to_return}, status=status.HTTP_200_OK)
 
@@ -825,6 +804,10 @@ class model_field_search(views.APIView):
 
 class transform(views.APIView):
     """ transform texts """
+
+    def get(self, request: Request):
+        return self.post(request)
+
     @extend_schema(responses={200: schemas_response.transform})
 
     def post(self, request: Request):
@@ -833,18 +816,45 @@ class transform(views.APIView):
         except jsonschema.exceptions.ValidationError as err:
             return Response({'response': err.message, 'schema': err.schema}, status=status.HTTP_400_BAD_REQUEST)
 
-        # embed
-        embeds = ai.embedding_model.encode(request.data['texts'])
+        # embed, documents as a whole instead of just their first max_seq_length tokens
+        if request.data.get('document', False):
+            embeds = ai.embedding_model.encode_documents(request.data['texts'])
+        else:
+            embeds = ai.embedding_model.encode(request.data['texts'])
 
         return Response({'vectors': embeds}, status=status.HTTP_200_OK)
 
 
 class cache_clear(views.APIView):
-    """ clear the cache """
+    """ clear the cache, or with ?index=<name> only the cached rankings of that index """
 
     def delete(self, request: Request):
-        cache.clear()
-        return Response({'response': 'success'}, status=status.HTTP_200_OK)
+        index_choice = request.query_params.get('index')
+        if index_choice is None:
+            cache.clear()
+            return Response({'response': 'success'}, status=status.HTTP_200_OK)
+
+        query_index = index.indexes.get(index_choice)
+        if query_index is None:
+            return Response({'response': f'invalid index {index_choice}'}, status=status.HTTP_400_BAD_REQUEST)
+        cache_generation = query_index.invalidate_cache()
+        return Response({'response': 'success', 'cache_generation': cache_generation}, status=status.HTTP_200_OK)
+
+
+class cache_stats(views.APIView):
+    """ hit, miss and eviction counters of the in-process cache of the worker that serves the request """
+
+    def get(self, request: Request):
+        if not hasattr(cache, 'stats'):  # ie a plain backend is configured
+            return Response({'response': 'The configured cache does not keep stats'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(cache.stats(), status=status.HTTP_200_OK)
+
+
+class embedding_stats(views.APIView):
+    """ batch size and queue wait histograms of the embedding micro-batcher of the worker that serves the request """
+
+    def get(self, request: Request):
+        return Response(ai.embedding_model.batcher.stats(), status=status.HTTP_200_OK)
 
 
 class alive(views.APIView):
@@ -852,3 +862,11 @@ class alive(views.APIView):
 
     def get(self, request: Request):
         return Response('HTTP_209_GOODMORNING', status=status.HTTP_200_OK)
+
+
+class ready(views.APIView):
+    """ check if the server is ready to take traffic, ie the hot indexes are loaded, and report the state of every index """
+
+    def get(self, request: Request):
+        is_ready, statuses = index.readiness()
+        return Response({'ready': is_ready, 'indexes': statuses}, status=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE)